@@ -0,0 +1,91 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.views.decorators.http import condition
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class VersionedCache:
+    """
+    Кэш сериализованных данных, которые меняются только через админку.
+
+    Ключи записей включают текущую версию, поэтому после invalidate()
+    старые записи перестают читаться. Версией служит время последнего
+    изменения данных, она же используется для ETag и Last-Modified.
+    """
+
+    def __init__(self, name, timeout=CACHE_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.version_key = f'{name}:version'
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, time.time(), None)
+            version = cache.get(self.version_key)
+
+        return version
+
+    def invalidate(self):
+        cache.set(self.version_key, time.time(), None)
+
+    def get_or_set(self, key, default):
+        return cache.get_or_set(
+            f'{self.name}:{self.get_version()}:{key}', default, self.timeout
+        )
+
+    def etag(self, request, *args, **kwargs):
+        key = f'{self.name}:{self.get_version()}:{request.get_full_path()}'
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def last_modified(self, request, *args, **kwargs):
+        return datetime.fromtimestamp(self.get_version(), tz=timezone.utc)
+
+    def condition(self):
+        """Декоратор представления, отвечающий 304 по ETag/Last-Modified."""
+        return condition(
+            etag_func=self.etag, last_modified_func=self.last_modified
+        )
+
+
+tags_cache = VersionedCache('tags')
+ingredients_cache = VersionedCache('ingredients')
+recipe_index_cache = VersionedCache('recipe_index')
+
+
+class RecipeCache:
+    """
+    Кэш не зависящей от пользователя части сериализованных рецептов.
+    Ключ включает время изменения рецепта, поэтому изменение рецепта,
+    его ингредиентов, тегов или автора (см. api.signals) делает старую
+    запись недоступной.
+    """
+
+    def __init__(self, timeout=CACHE_TIMEOUT):
+        self.timeout = timeout
+
+    def _get_key(self, recipe):
+        return f'recipe:{recipe.id}:{recipe.updated_at.timestamp()}'
+
+    def get_many(self, recipes):
+        keys = {self._get_key(recipe): recipe.id for recipe in recipes}
+        return {
+            keys[key]: fragment
+            for key, fragment in cache.get_many(keys).items()
+        }
+
+    def set_many(self, recipes, fragments):
+        cache.set_many(
+            {
+                self._get_key(recipe): fragments[recipe.id]
+                for recipe in recipes
+            },
+            self.timeout,
+        )
+
+
+recipe_cache = RecipeCache()
@@ -1,13 +1,196 @@
+from django.db import connection
+from django.db.models import (
+    BooleanField,
+    CharField,
+    Exists,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Value,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Concat, StrIndex
 from django_filters import rest_framework
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import (
+    BaseFilterBackend,
+    OrderingFilter,
+    SearchFilter,
+)
 from recipes.models import FavoriteList, Recipe, ShoppingList, Tag
+from .indexes import recipe_ingredient_index, recipe_search_index
 from .serializers import FAVORITED_KEY, SHOPPING_CART_KEY
 
+SEARCH_CONFIG = 'russian'
+RANK_KEY = 'rank'
+MAX_MATCH_INGREDIENTS = 100
+
 
 class IngredientFilter(SearchFilter):
     search_param = 'name'
 
 
+def rank_by_position(queryset, recipes_id):
+    """
+    Оставляем рецепты из списка и добавляем ранг по их порядку в нём.
+    Рангом служит позиция id в строке ",id1,id2,...," со знаком минус:
+    один параметр вместо CASE на тысячу веток. StrIndex выполняется как
+    INSTR на SQLite и как STRPOS на PostgreSQL.
+    """
+    if not recipes_id:
+        return queryset.annotate(
+            **{RANK_KEY: Value(0, output_field=IntegerField())}
+        ).none()
+
+    position = StrIndex(
+        Value(f',{",".join(map(str, recipes_id))},'),
+        Concat(Value(','), Cast('id', output_field=CharField()), Value(',')),
+    )
+    return queryset.filter(id__in=recipes_id).annotate(
+        **{RANK_KEY: -position}
+    )
+
+
+class TrigramMatch(Func):
+    """Оператор pg_trgm: строка похожа на запрос, использует GIN-индекс."""
+
+    arg_joiner = ' %% '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+class RecipeSearchFilter(SearchFilter):
+    """
+    Полнотекстовый поиск рецептов по ?search=. На PostgreSQL ищем по
+    столбцу search_vector (название и описание) и сортируем по рангу, а
+    если ничего не нашлось, ищем похожие названия по триграммам. На других
+    базах используем инвертированный индекс в памяти процесса.
+    """
+
+    @classmethod
+    def get_query(cls, request):
+        return request.query_params.get(cls.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        query = self.get_query(request)
+        if not query:
+            return queryset
+
+        if connection.vendor == 'postgresql':
+            return self.postgres_search(queryset, query)
+
+        return self.index_search(queryset, query)
+
+    def postgres_search(self, queryset, query):
+        from django.contrib.postgres.search import (
+            SearchQuery,
+            SearchRank,
+            SearchVectorField,
+            TrigramSimilarity,
+        )
+
+        quote_name = connection.ops.quote_name
+        vector = RawSQL(
+            f'{quote_name(Recipe._meta.db_table)}.'
+            f'{quote_name("search_vector")}',
+            (),
+            output_field=SearchVectorField(),
+        )
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        found = (
+            queryset.alias(search_document=vector)
+            .filter(search_document=search_query)
+            .annotate(**{RANK_KEY: SearchRank(vector, search_query)})
+        )
+        if found.exists():
+            return found
+
+        return queryset.annotate(
+            **{RANK_KEY: TrigramSimilarity('name', query)}
+        ).filter(TrigramMatch(F('name'), Value(query)))
+
+    def index_search(self, queryset, query):
+        return rank_by_position(
+            queryset,
+            [pk for pk, _ in recipe_search_index.search(query)],
+        )
+
+
+class RecipeIngredientMatchFilter(BaseFilterBackend):
+    """
+    Подбор рецептов по имеющимся ингредиентам ?ingredients=1,2,3 для
+    действия by_ingredients. Сначала идут рецепты, для которых есть все
+    ингредиенты, затем с наименьшим числом недостающих.
+    """
+
+    query_param = 'ingredients'
+
+    @classmethod
+    def get_ingredients_id(cls, request):
+        values = request.query_params.getlist(cls.query_param)
+        try:
+            ingredients_id = {
+                int(value)
+                for value in ','.join(values).split(',')
+                if value.strip()
+            }
+        except ValueError:
+            raise ValidationError(
+                {cls.query_param: 'Укажите id ингредиентов через запятую.'}
+            )
+
+        if not ingredients_id:
+            raise ValidationError(
+                {cls.query_param: 'Укажите хотя бы один ингредиент.'}
+            )
+        if len(ingredients_id) > MAX_MATCH_INGREDIENTS:
+            raise ValidationError(
+                {
+                    cls.query_param: 'Можно указать не больше '
+                    f'{MAX_MATCH_INGREDIENTS} ингредиентов.'
+                }
+            )
+
+        return ingredients_id
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) != 'by_ingredients':
+            return queryset
+
+        return rank_by_position(
+            queryset,
+            [
+                pk
+                for pk, _, _ in recipe_ingredient_index.match(
+                    self.get_ingredients_id(request)
+                )
+            ],
+        )
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """
+    Сортировка рецептов по ?ordering=. К выбранным полям добавляем -id,
+    чтобы порядок был однозначным и совпадал с индексом. Если рецепты
+    ранжированы поиском или подбором, по умолчанию сортируем по рангу.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        if RANK_KEY in queryset.query.annotations and not (
+            request.query_params.get(self.ordering_param)
+        ):
+            ordering = (f'-{RANK_KEY}',)
+        else:
+            ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id'} & set(ordering):
+            return (*ordering, '-id')
+
+        return ordering
+
+
 class RecipeFilter(rest_framework.FilterSet):
     is_favorited = rest_framework.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = rest_framework.BooleanFilter(
@@ -18,6 +201,7 @@ class RecipeFilter(rest_framework.FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='get_tags',
     )
 
     class Meta:
@@ -32,15 +216,32 @@ class RecipeFilter(rest_framework.FilterSet):
     def _many_to_many_recipe_filter(self, queryset, value, model):
         user = self.request.user
         if not user.is_authenticated:
-            return Recipe.objects.none()
+            return queryset.none()
 
-        filter_id = model.objects.values_list('recipe_id', flat=True).filter(
-            user_id=user.id
+        in_list = Exists(
+            model.objects.filter(user_id=user.id, recipe_id=OuterRef('pk'))
         )
         if value:
-            return queryset.filter(id__in=filter_id)
+            return queryset.filter(in_list)
+
+        return queryset.filter(~in_list)
 
-        return queryset.exclude(id__in=filter_id)
+    def get_tags(self, queryset, name, value):
+        """
+        Фильтруем рецепты по тегам через EXISTS к промежуточной таблице,
+        чтобы рецепт с несколькими подходящими тегами не дублировался.
+        """
+        if not value:
+            return queryset
+
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    tag_id__in=[tag.id for tag in value],
+                )
+            )
+        )
 
     def get_is_favorited(self, queryset, name, value):
         return self._many_to_many_recipe_filter(queryset, value, FavoriteList)
@@ -0,0 +1,337 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import islice
+from operator import itemgetter
+
+from django.db.models import Count, Max, Sum
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from .cache import ingredients_cache, recipe_index_cache
+
+INDEX_TTL = 300
+MAX_CHAR = '\U0010ffff'
+TOKEN_RE = re.compile(r'\w+')
+NAME_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+PREFIX_FACTOR = 0.5
+SEARCH_LIMIT = 1000
+INGREDIENT_SEARCH_LIMIT = 50
+REINDEX_OVERLAP = timedelta(minutes=5)
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения по названию.
+
+    Названия хранятся в отсортированном массиве в нижнем регистре, поэтому
+    поиск по префиксу выполняется бинарным поиском без запроса к базе.
+    Индекс перестраивается, когда меняется версия ingredients_cache (см.
+    сигналы в api.signals), но не реже чем раз в INDEX_TTL секунд.
+    """
+
+    def __init__(self, versioned_cache, ttl=INDEX_TTL):
+        self.versioned_cache = versioned_cache
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Ключи и строки меняются одним присваиванием, чтобы поиск без
+        # блокировки не увидел ключи одной сборки и строки другой.
+        self._data = ([], [])
+        self._version = None
+        self._built_at = 0
+
+    def _is_actual(self, version):
+        return (
+            version == self._version
+            and time.monotonic() - self._built_at < self.ttl
+        )
+
+    def _refresh(self):
+        version = self.versioned_cache.get_version()
+        if self._is_actual(version):
+            return
+
+        with self._lock:
+            if self._is_actual(version):
+                return
+
+            rows = sorted(
+                Ingredient.objects.values('id', 'name', 'measurement_unit'),
+                key=lambda row: row['name'].lower(),
+            )
+            self._data = ([row['name'].lower() for row in rows], rows)
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def search(self, name, limit=INGREDIENT_SEARCH_LIMIT):
+        """
+        Возвращаем до limit ингредиентов: сначала те, название которых
+        начинается с name, затем те, в названии которых name встречается
+        в другом месте. Просмотр названий останавливается, как только
+        набрано limit ингредиентов.
+        """
+        self._refresh()
+        keys, rows = self._data
+        name = name.lower()
+        start = bisect_left(keys, name)
+        end = bisect_left(keys, name + MAX_CHAR, start)
+        found = rows[start:min(end, start + limit)]
+        if len(found) == limit:
+            return found
+
+        contains = (
+            row
+            for key, row in zip(keys, rows)
+            if name in key and not key.startswith(name)
+        )
+        return found + list(islice(contains, limit - len(found)))
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+class RecipeIndex:
+    """
+    Базовый класс индексов рецептов в памяти процесса.
+
+    Когда меняется версия recipe_index_cache (после коммита изменения
+    рецептов), но не реже чем раз в INDEX_TTL секунд, рецепты, изменённые
+    после последней индексации, переиндексируются. Окно берётся с запасом
+    REINDEX_OVERLAP на транзакции, закоммиченные позже своего updated_at.
+    Удалённые рецепты находим по отпечатку (число, наибольший id и сумма
+    id): удаление вместе с созданием другого рецепта меняет наибольший id
+    и сумму, даже если число рецептов осталось прежним.
+
+    Наследники реализуют _clear(), _load(recipes), _indexed_ids() и
+    _unindex_recipe(recipe_id).
+    """
+
+    def __init__(self, versioned_cache, ttl=INDEX_TTL):
+        self.versioned_cache = versioned_cache
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._updated_at = None
+        self._version = None
+        self._checked_at = 0
+        self._clear()
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _load(self, recipes):
+        raise NotImplementedError
+
+    def _indexed_ids(self):
+        raise NotImplementedError
+
+    def _unindex_recipe(self, recipe_id):
+        raise NotImplementedError
+
+    def _seen(self, updated_at):
+        if self._updated_at is None or updated_at > self._updated_at:
+            self._updated_at = updated_at
+
+    def _refresh(self):
+        version = self.versioned_cache.get_version()
+        if (
+            version == self._version
+            and time.monotonic() - self._checked_at < self.ttl
+        ):
+            return
+
+        self._version = version
+        self._checked_at = time.monotonic()
+        if self._updated_at is None:
+            self._load(Recipe.objects.all())
+            return
+
+        self._load(
+            Recipe.objects.filter(
+                updated_at__gte=self._updated_at - REINDEX_OVERLAP
+            )
+        )
+        indexed_ids = self._indexed_ids()
+        fingerprint = Recipe.objects.aggregate(
+            count=Count('id'), max_id=Max('id'), sum_id=Sum('id')
+        )
+        if fingerprint != {
+            'count': len(indexed_ids),
+            'max_id': max(indexed_ids, default=None),
+            'sum_id': sum(indexed_ids) if indexed_ids else None,
+        }:
+            self._sync_ids(indexed_ids)
+
+    def _sync_ids(self, indexed_ids):
+        """Убираем из индекса удалённые рецепты и добавляем пропущенные."""
+        recipes_id = set(Recipe.objects.values_list('id', flat=True))
+        for recipe_id in set(indexed_ids) - recipes_id:
+            self._unindex_recipe(recipe_id)
+        missing = recipes_id.difference(indexed_ids)
+        if missing:
+            self._load(Recipe.objects.filter(id__in=missing))
+
+
+class RecipeSearchIndex(RecipeIndex):
+    """
+    Инвертированный индекс рецептов: слово -> {id рецепта: вес}.
+    Используется для поиска, когда база не PostgreSQL.
+    """
+
+    def _clear(self):
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+
+    def _indexed_ids(self):
+        return self._documents.keys()
+
+    def _index_recipe(self, recipe_id, name, text):
+        self._unindex_recipe(recipe_id)
+        weights = dict.fromkeys(tokenize(text), TEXT_WEIGHT)
+        for token in tokenize(name):
+            weights[token] = weights.get(token, 0) + NAME_WEIGHT
+
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                insort(self._tokens, token)
+            self._postings[token][recipe_id] = weight
+
+        self._documents[recipe_id] = tuple(weights)
+
+    def _unindex_recipe(self, recipe_id):
+        for token in self._documents.pop(recipe_id, ()):
+            self._postings[token].pop(recipe_id, None)
+
+    def _load(self, recipes):
+        for recipe_id, name, text, updated_at in recipes.values_list(
+            'id', 'name', 'text', 'updated_at'
+        ).iterator():
+            self._index_recipe(recipe_id, name, text)
+            self._seen(updated_at)
+
+    def _match(self, term):
+        """Ищем рецепты со словами, начинающимися с term."""
+        start = bisect_left(self._tokens, term)
+        end = bisect_left(self._tokens, term + MAX_CHAR, start)
+        tokens = self._tokens[start:end]
+        if tokens == [term]:
+            return self._postings[term]
+
+        matched = {}
+        for token in tokens:
+            factor = 1 if token == term else PREFIX_FACTOR
+            for recipe_id, weight in self._postings[token].items():
+                matched[recipe_id] = max(
+                    matched.get(recipe_id, 0), weight * factor
+                )
+
+        return matched
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Возвращаем до limit пар (id рецепта, ранг), отсортированных по
+        убыванию ранга. Рецепт должен содержать все слова запроса.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            self._refresh()
+            scores = self._match(terms[0])
+            for term in terms[1:]:
+                if not scores:
+                    break
+                matched = self._match(term)
+                # Проходим по меньшему из двух словарей.
+                if len(matched) < len(scores):
+                    scores, matched = matched, scores
+                scores = {
+                    recipe_id: score + matched[recipe_id]
+                    for recipe_id, score in scores.items()
+                    if recipe_id in matched
+                }
+
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1, 0))
+
+
+class RecipeIngredientIndex(RecipeIndex):
+    """
+    Инвертированный индекс ингредиент -> отсортированный массив id
+    рецептов. Для подбора рецептов по имеющимся ингредиентам.
+    """
+
+    def _clear(self):
+        self._postings = {}
+        self._recipes = {}
+
+    def _indexed_ids(self):
+        return self._recipes.keys()
+
+    def _unindex_recipe(self, recipe_id):
+        for ingredient_id in self._recipes.pop(recipe_id, ()):
+            postings = self._postings[ingredient_id]
+            position = bisect_left(postings, recipe_id)
+            if position < len(postings) and postings[position] == recipe_id:
+                del postings[position]
+
+    def _index_recipe(self, recipe_id, ingredients_id):
+        self._unindex_recipe(recipe_id)
+        for ingredient_id in ingredients_id:
+            postings = self._postings.setdefault(ingredient_id, array('q'))
+            # При полной загрузке рецепты идут по возрастанию id.
+            if not postings or postings[-1] < recipe_id:
+                postings.append(recipe_id)
+            else:
+                postings.insert(bisect_left(postings, recipe_id), recipe_id)
+
+        self._recipes[recipe_id] = ingredients_id
+
+    def _load(self, recipes):
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in (
+            RecipeIngredient.objects.filter(recipe__in=recipes.values('id'))
+            .order_by()
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator()
+        ):
+            ingredients[recipe_id].append(ingredient_id)
+
+        for recipe_id, updated_at in (
+            recipes.order_by('id').values_list('id', 'updated_at').iterator()
+        ):
+            self._index_recipe(recipe_id, tuple(set(ingredients[recipe_id])))
+            self._seen(updated_at)
+
+    def match(self, ingredients_id, limit=SEARCH_LIMIT):
+        """
+        Возвращаем до limit троек (id рецепта, найдено, не хватает): сначала
+        рецепты, для которых есть все ингредиенты, затем с наименьшим числом
+        недостающих, при равенстве - с большим числом найденных.
+        """
+        with self._lock:
+            self._refresh()
+            found = Counter()
+            for ingredient_id in set(ingredients_id):
+                found.update(self._postings.get(ingredient_id, ()))
+
+            recipes = self._recipes
+            return heapq.nsmallest(
+                limit,
+                (
+                    (recipe_id, count, len(recipes[recipe_id]) - count)
+                    for recipe_id, count in found.items()
+                ),
+                key=lambda match: (match[2], -match[1], -match[0]),
+            )
+
+
+ingredient_index = IngredientIndex(ingredients_cache)
+recipe_search_index = RecipeSearchIndex(recipe_index_cache)
+recipe_ingredient_index = RecipeIngredientIndex(recipe_index_cache)
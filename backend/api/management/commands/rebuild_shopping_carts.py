@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+
+from api.utils import rebuild_shopping_cart_ingredients
+from recipes.models import ShoppingCartIngredient, ShoppingList
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт суммарных количеств ингредиентов в корзинах '
+        'пользователей по спискам покупок.'
+    )
+
+    def handle(self, *args, **options):
+        users_id = sorted(
+            set(ShoppingList.objects.values_list('user_id', flat=True))
+            | set(
+                ShoppingCartIngredient.objects.values_list(
+                    'user_id', flat=True
+                )
+            )
+        )
+        for start in range(0, len(users_id), BATCH_SIZE):
+            rebuild_shopping_cart_ingredients(
+                users_id[start:start + BATCH_SIZE]
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuild completed: {len(users_id)} shopping carts'
+            )
+        )
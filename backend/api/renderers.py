@@ -0,0 +1,137 @@
+import csv
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 20
+PDF_CHUNK_SIZE = 64 * 1024
+PDF_MEMORY_SIZE = 1024 * 1024
+CSV_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    """Регистрируем шрифт с кириллицей один раз на процесс."""
+    pdfmetrics.registerFont(
+        TTFont(PDF_FONT_NAME, settings.SHOPPING_CART_PDF_FONT)
+    )
+    return PDF_FONT_NAME
+
+
+def get_ingredient_fields(ingredient):
+    return (
+        ingredient['ingredient__name'],
+        ingredient['ingredient__measurement_unit'],
+        ingredient['total_amount'],
+    )
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок. Строки ингредиентов читаются из
+    итератора и отдаются клиенту частями через stream().
+    """
+
+    charset = 'utf-8'
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+
+        return self.media_type
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Используется DRF только для ответов с ошибками."""
+        if data is None:
+            return b''
+
+        return str(data.get('detail', data)).encode('utf-8')
+
+    def stream(self, ingredients):
+        raise NotImplementedError(
+            'ShoppingCartRenderer.stream() must be implemented.'
+        )
+
+
+class TextShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for ingredient in ingredients:
+            name, measurement_unit, amount = get_ingredient_fields(ingredient)
+            yield f'{name} ({measurement_unit}) - {amount} \n'
+
+
+class Echo:
+    """Объект-заглушка для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CsvShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(CSV_HEADER)
+        for ingredient in ingredients:
+            yield writer.writerow(get_ingredient_fields(ingredient))
+
+
+class PdfShoppingCartRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def _new_page(self, pdf):
+        pdf.setFont(get_pdf_font(), PDF_FONT_SIZE)
+        return A4[1] - PDF_MARGIN
+
+    def stream(self, ingredients):
+        """
+        Рисуем страницы по мере чтения ингредиентов, но reportlab собирает
+        файл целиком только в save(), поэтому клиент получает первые байты
+        после последней страницы. Чтобы большой список не занимал память,
+        документ пишется во временный файл, начиная с PDF_MEMORY_SIZE.
+        """
+        with SpooledTemporaryFile(max_size=PDF_MEMORY_SIZE) as buffer:
+            pdf = canvas.Canvas(buffer, pagesize=A4)
+            pdf.setTitle('Список покупок')
+            y = self._new_page(pdf)
+            for ingredient in ingredients:
+                if y < PDF_MARGIN:
+                    pdf.showPage()
+                    y = self._new_page(pdf)
+
+                name, measurement_unit, amount = get_ingredient_fields(
+                    ingredient
+                )
+                pdf.drawString(
+                    PDF_MARGIN, y, f'{name} ({measurement_unit}) - {amount}'
+                )
+                y -= PDF_LINE_HEIGHT
+
+            pdf.showPage()
+            pdf.save()
+            buffer.seek(0)
+            yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+SHOPPING_CART_RENDERERS = (
+    TextShoppingCartRenderer,
+    CsvShoppingCartRenderer,
+    PdfShoppingCartRenderer,
+)
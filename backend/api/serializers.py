@@ -1,16 +1,38 @@
-import base64
+from collections import OrderedDict
 
-from django.core.files.base import ContentFile
+from django.contrib.auth.models import AnonymousUser
 from django.db import transaction
+from django.db.models import Manager
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from recipes.images import (
+    InvalidImage,
+    decode_base64_to_file,
+    get_thumbnail_urls,
+    validate_image_header,
+)
 from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
-from users.serializers import UserSerializer
-from .utils import is_favorited, is_in_shopping_cart
+from users.serializers import IS_SUBSCRIBED_KEY, UserSerializer
+from users.utils import is_subscribed
+from .cache import recipe_cache
+from .utils import (
+    annotate_user_flags,
+    change_shopping_cart_ingredients,
+    get_amounts_difference,
+    is_favorited,
+    is_in_shopping_cart,
+    prefetch_recipe_related,
+    updating_shopping_carts,
+)
 
 FAVORITED_KEY = 'is_favorited'
 SHOPPING_CART_KEY = 'is_in_shopping_cart'
+AUTHOR_SUBSCRIBED_KEY = 'is_author_subscribed'
+DOES_NOT_EXIST = serializers.PrimaryKeyRelatedField.default_error_messages[
+    'does_not_exist'
+]
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -57,14 +79,72 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
-    """Сериалайзер просмотра рецептов."""
+class RecipeFragmentSerializer(serializers.ModelSerializer):
+    """
+    Сериалайзер не зависящей от пользователя части рецепта, которая
+    хранится в кэше. Используется без request в контексте.
+    """
 
     tags = TagSerializer(many=True)
     author = UserSerializer()
     ingredients = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'id',
+            'tags',
+            'author',
+            'ingredients',
+            'name',
+            'image',
+            'text',
+            'cooking_time',
+        )
+
+    def get_ingredients(self, obj):
+        qs = obj.recipe_ingredient.all()
+        return RecipeIngredientSerializer(qs, many=True).data
+
+
+def get_recipe_fragments(recipes):
+    """
+    Получаем кэшированные фрагменты рецептов одним запросом к кэшу,
+    недостающие сериализуем, подгрузив связанные объекты пачкой.
+    """
+    fragments = recipe_cache.get_many(recipes)
+    missing = [recipe for recipe in recipes if recipe.id not in fragments]
+    if missing:
+        prefetch_recipe_related(missing)
+        built = {
+            recipe.id: RecipeFragmentSerializer(recipe).data
+            for recipe in missing
+        }
+        recipe_cache.set_many(missing, built)
+        fragments.update(built)
+
+    return fragments
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        fragments = get_recipe_fragments(recipes)
+        return [
+            self.child.personalize(fragments[recipe.id], recipe)
+            for recipe in recipes
+        ]
+
+
+class RecipeSerializer(RecipeFragmentSerializer):
+    """
+    Сериалайзер просмотра рецептов: кэшированный фрагмент рецепта
+    дополняется признаками, зависящими от пользователя.
+    """
+
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -77,39 +157,187 @@ class RecipeSerializer(serializers.ModelSerializer):
             SHOPPING_CART_KEY,
             'name',
             'image',
+            'thumbnails',
             'text',
             'cooking_time',
         )
+        list_serializer_class = RecipeListSerializer
 
     def _get_request(self):
         return self.context.get('request')
 
-    def get_ingredients(self, obj):
-        qs = obj.recipe_ingredient.all()
-        return RecipeIngredientSerializer(qs, many=True).data
-
     def get_is_favorited(self, obj):
+        if hasattr(obj, FAVORITED_KEY):
+            return getattr(obj, FAVORITED_KEY)
+
         return is_favorited(self._get_request(), obj.id)
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, SHOPPING_CART_KEY):
+            return getattr(obj, SHOPPING_CART_KEY)
+
         return is_in_shopping_cart(self._get_request(), obj.id)
 
+    def get_is_author_subscribed(self, obj):
+        if hasattr(obj, AUTHOR_SUBSCRIBED_KEY):
+            return getattr(obj, AUTHOR_SUBSCRIBED_KEY)
+
+        request = self._get_request()
+        return bool(request) and is_subscribed(request.user, obj.author_id)
+
+    def get_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, self._get_request())
+
+    def personalize(self, fragment, obj):
+        data = dict(
+            fragment,
+            author=dict(
+                fragment['author'],
+                **{IS_SUBSCRIBED_KEY: self.get_is_author_subscribed(obj)},
+            ),
+            **{
+                FAVORITED_KEY: self.get_is_favorited(obj),
+                SHOPPING_CART_KEY: self.get_is_in_shopping_cart(obj),
+                'thumbnails': self.get_thumbnails(obj),
+            },
+        )
+        request = self._get_request()
+        if request is not None and data['image']:
+            data['image'] = request.build_absolute_uri(data['image'])
+
+        return OrderedDict((field, data[field]) for field in self.Meta.fields)
+
+    def to_representation(self, instance):
+        fragment = get_recipe_fragments([instance])[instance.id]
+        return self.personalize(fragment, instance)
+
+
+class RecipeMatchSerializer(RecipeSerializer):
+    """
+    Рецепт в подборе по ингредиентам: дополнительно выводим ингредиенты
+    рецепта, которых нет среди переданных в context['ingredients_id'].
+    """
+
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = (*RecipeSerializer.Meta.fields, 'missing_ingredients')
+
+    def get_missing_ingredients(self, ingredients):
+        available = self.context.get('ingredients_id', ())
+        return [
+            ingredient
+            for ingredient in ingredients
+            if ingredient['id'] not in available
+        ]
+
+    def personalize(self, fragment, obj):
+        return super().personalize(
+            dict(
+                fragment,
+                missing_ingredients=self.get_missing_ingredients(
+                    fragment['ingredients']
+                ),
+            ),
+            obj,
+        )
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Поле, получающее все переданные объекты одним запросом in_bulk."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        ids = []
+        for pk in data:
+            try:
+                ids.append(int(pk))
+            except (TypeError, ValueError):
+                self.child_relation.fail(
+                    'incorrect_type', data_type=type(pk).__name__
+                )
+
+        objects = self.child_relation.get_queryset().in_bulk(ids)
+        for pk in ids:
+            if pk not in objects:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+
+        return [objects[pk] for pk in ids]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который при many=True валидирует id пачкой."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class AddIngredientListSerializer(serializers.ListSerializer):
+    """Получаем все ингредиенты рецепта одним запросом in_bulk."""
+
+    def to_internal_value(self, data):
+        ingredients = super().to_internal_value(data)
+        objects = Ingredient.objects.in_bulk(
+            {ingredient.get('id') for ingredient in ingredients}
+        )
+        errors = [
+            {}
+            if ingredient.get('id') in objects
+            else {'id': [DOES_NOT_EXIST.format(pk_value=ingredient.get('id'))]}
+            for ingredient in ingredients
+        ]
+        if any(errors):
+            raise ValidationError(errors)
+
+        for ingredient in ingredients:
+            ingredient['id'] = objects[ingredient.get('id')]
+        return ingredients
+
 
 class AddIngredientToRecipeSerializer(serializers.Serializer):
     """
     Сериалайзер для использования в качестве поля в CreateRecipeSerializer.
     """
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
-    amount = serializers.IntegerField()
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(
+        min_value=1,
+        error_messages={
+            'min_value': 'Количество ингридиента должно быть больше единицы.'
+        },
+    )
+
+    class Meta:
+        list_serializer_class = AddIngredientListSerializer
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Поле изображения в base64. Строка декодируется во временный файл,
+    изображение проверяется только по заголовку, а уменьшенные копии
+    строятся после сохранения рецепта в фоне.
+    """
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=f'image.{ext}')
+            _, imgstr = data.split(';base64,')
+            try:
+                file = decode_base64_to_file(imgstr)
+                ext = validate_image_header(file)
+            except InvalidImage as error:
+                raise ValidationError(str(error))
+
+            file.name = f'image.{ext}'
+            return serializers.FileField.to_internal_value(self, file)
 
         return super().to_internal_value(data)
 
@@ -118,9 +346,7 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     """Сериалайзер создания рецептов."""
 
     ingredients = AddIngredientToRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all()
-    )
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     image = Base64ImageField()
 
     class Meta:
@@ -137,14 +363,55 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('author',)
 
     def _add_ingredients(self, ingredients, recipe):
-        for ingredient in ingredients:
-            ingredient_instance = ingredient.get('id')
-            amount = ingredient.get('amount')
-            RecipeIngredient.objects.create(
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredient_instance,
-                amount=amount,
+                ingredient=ingredient.get('id'),
+                amount=ingredient.get('amount'),
             )
+            for ingredient in ingredients
+        )
+
+    def _update_ingredients(self, ingredients, recipe):
+        """
+        Изменяем только отличающиеся строки ингредиентов рецепта и
+        возвращаем прежние и новые количества ингредиентов.
+        """
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredient.all()
+        }
+        new_amounts = {
+            ingredient.get('id').id: ingredient.get('amount')
+            for ingredient in ingredients
+        }
+
+        old_amounts = {
+            ingredient_id: recipe_ingredient.amount
+            for ingredient_id, recipe_ingredient in current.items()
+        }
+
+        to_update = []
+        for ingredient_id, recipe_ingredient in current.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != recipe_ingredient.amount:
+                recipe_ingredient.amount = amount
+                to_update.append(recipe_ingredient)
+        removed = current.keys() - new_amounts.keys()
+        if removed:
+            recipe.recipe_ingredient.filter(
+                ingredient_id__in=removed
+            ).delete()
+        RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+        self._add_ingredients(
+            (
+                ingredient
+                for ingredient in ingredients
+                if ingredient.get('id').id not in current
+            ),
+            recipe,
+        )
+        return old_amounts, new_amounts
 
     @transaction.atomic
     def create(self, validated_data):
@@ -159,6 +426,7 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         return recipe
 
     @transaction.atomic
+    @updating_shopping_carts()
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
         instance.image = validated_data.get('image', instance.image)
@@ -166,30 +434,40 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        instance.tags.clear()
-        instance.tags.set(validated_data.get('tags', instance.tags))
-        instance.ingredients.clear()
-        self._add_ingredients(validated_data.get('ingredients'), instance)
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data.get('tags'))
+
+        if 'ingredients' in validated_data:
+            old_amounts, new_amounts = self._update_ingredients(
+                validated_data.get('ingredients'), instance
+            )
+            change_shopping_cart_ingredients(
+                instance.shopping.values_list('user_id', flat=True),
+                get_amounts_difference(old_amounts, new_amounts),
+            )
+
         instance.save()
         return instance
 
     def validate(self, attrs):
-        ingredients = attrs.get('ingredients')
-        unique_ingredients = []
+        ingredients = attrs.get('ingredients', ())
+        unique_ingredients = set()
         for ingredient in ingredients:
             instance = ingredient.get('id')
-            RecipeIngredientSerializer(data=ingredient).is_valid(
-                raise_exception=True
-            )
-            if instance in unique_ingredients:
+            if instance.id in unique_ingredients:
                 raise ValidationError(
                     {'ingredients': f'Дублирование ингридиента {instance}'}
                 )
-            unique_ingredients.append(instance)
+            unique_ingredients.add(instance.id)
         return attrs
 
     def to_representation(self, value):
-        return RecipeSerializer(value).data
+        request = self.context.get('request')
+        user = request.user if request else AnonymousUser()
+        recipe = annotate_user_flags(
+            Recipe.objects.filter(id=value.id), user
+        ).get()
+        return RecipeSerializer(recipe, context=self.context).data
 
 
 class ShortRecipesSerializer(serializers.ModelSerializer):
@@ -197,11 +475,28 @@ class ShortRecipesSerializer(serializers.ModelSerializer):
     Сериалайзер для компактного отображения рецепта
     """
 
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time',
         )
+
+    def get_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, self.context.get('request'))
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """
+    Сериалайзер списка рецептов для пакетного изменения избранного
+    и корзины.
+    """
+
+    recipes = BulkPrimaryKeyRelatedField(
+        many=True, queryset=Recipe.objects.all()
+    )
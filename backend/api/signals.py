@@ -0,0 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.feeds import schedule_fan_out
+from recipes.images import needs_processing, schedule_image_processing
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingList,
+    Tag,
+)
+from .cache import ingredients_cache, recipe_index_cache, tags_cache
+from .utils import (
+    is_updating_shopping_carts,
+    rebuild_shopping_cart_ingredients,
+)
+
+User = get_user_model()
+
+
+def touch_recipes(**filters):
+    """Обновляем время изменения рецептов, сбрасывая их кэш и индексы."""
+    Recipe.objects.filter(**filters).update(updated_at=timezone.now())
+    transaction.on_commit(recipe_index_cache.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags_cache(**kwargs):
+    tags_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients_cache(**kwargs):
+    ingredients_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe_indexes(**kwargs):
+    # Индексы должны перечитать рецепт уже после коммита транзакции.
+    transaction.on_commit(recipe_index_cache.invalidate)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(instance, **kwargs):
+    touch_recipes(tags=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(instance, **kwargs):
+    touch_recipes(ingredients=instance)
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(instance, created, **kwargs):
+    if not created:
+        touch_recipes(author=instance)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_on_tags_change(instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        touch_recipes(tags=instance)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            touch_recipes(pk=instance.pk)
+        elif pk_set:
+            touch_recipes(pk__in=pk_set)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def touch_recipe_on_ingredients_change(instance, **kwargs):
+    # API сохраняет рецепт после изменения ингредиентов сам.
+    if not is_updating_shopping_carts():
+        touch_recipes(pk=instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(instance, **kwargs):
+    if needs_processing(instance):
+        schedule_image_processing(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(instance, created, **kwargs):
+    if created:
+        schedule_fan_out(instance)
+
+
+def schedule_shopping_carts_rebuild(users_id):
+    users_id = list(users_id)
+    if users_id:
+        transaction.on_commit(
+            lambda: rebuild_shopping_cart_ingredients(users_id)
+        )
+
+
+# API обновляет агрегат корзин сам (см. updating_shopping_carts), а
+# изменения из админки и каскадные удаления пересчитывают его после
+# коммита.
+@receiver((post_save, post_delete), sender=ShoppingList)
+def rebuild_shopping_cart(instance, **kwargs):
+    if not is_updating_shopping_carts():
+        schedule_shopping_carts_rebuild((instance.user_id,))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def rebuild_recipe_shopping_carts(instance, **kwargs):
+    if not is_updating_shopping_carts():
+        schedule_shopping_carts_rebuild(
+            ShoppingList.objects.filter(
+                recipe_id=instance.recipe_id
+            ).values_list('user_id', flat=True)
+        )
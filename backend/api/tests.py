@@ -0,0 +1,707 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (
+    FavoriteList,
+    FeedEntry,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCartIngredient,
+    ShoppingList,
+    Tag,
+)
+from users.authentication import token_cache
+from users.models import Follow, User
+from .cache import recipe_index_cache
+from .filters import RANK_KEY, RecipeFilter, rank_by_position
+from .indexes import (
+    INGREDIENT_SEARCH_LIMIT,
+    RecipeIngredientIndex,
+    RecipeSearchIndex,
+    ingredient_index,
+)
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+class RecipeAPITestCase(TestCase):
+    """Общие данные для тестов API рецептов."""
+
+    @classmethod
+    def create_user(cls, username):
+        return User.objects.create_user(
+            username=username,
+            email=f'{username}@example.com',
+            first_name=username,
+            last_name=username,
+            password='password-12345',
+        )
+
+    @classmethod
+    def create_recipe(cls, author, name, ingredients=(), tags=(), amount=1):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=name,
+            text=f'Описание {name}',
+            image='recipes/images/test.jpg',
+            cooking_time=10,
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient in ingredients
+        )
+        recipe.tags.set(tags)
+        return recipe
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('user')
+        cls.author = cls.create_user('author')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(5)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(40)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_cart_amounts(self, user):
+        return dict(
+            ShoppingCartIngredient.objects.filter(user=user).values_list(
+                'ingredient_id', 'amount'
+            )
+        )
+
+    def get_expected_cart_amounts(self, user):
+        return dict(
+            RecipeIngredient.objects.filter(recipe__shopping__user=user)
+            .values_list('ingredient_id')
+            .annotate(total=Sum('amount'))
+            .values_list('ingredient_id', 'total')
+            .order_by()
+        )
+
+    def assertCartConsistent(self, user):
+        self.assertEqual(
+            self.get_cart_amounts(user), self.get_expected_cart_amounts(user)
+        )
+
+    def auth_client(self, user):
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+
+class RecipeListQueriesTest(RecipeAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        authors = [cls.create_user(f'author{i}') for i in range(5)]
+        for i in range(100):
+            cls.create_recipe(
+                authors[i % 5],
+                f'рецепт {i}',
+                cls.ingredients[i % 30:i % 30 + 5],
+                cls.tags[:i % 5 + 1],
+            )
+
+    def assertListQueries(self, limit, cold, warm):
+        with self.assertNumQueries(cold):
+            response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(len(response.data['results']), limit)
+
+        with self.assertNumQueries(warm):
+            self.client.get('/api/recipes/', {'limit': limit})
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for limit in (6, 100):
+            cache.clear()
+            with self.subTest(limit=limit):
+                self.assertListQueries(limit, cold=5, warm=2)
+
+    @mock.patch('users.paginations.COUNT_CACHE_THRESHOLD', 1)
+    def test_approximate_count_is_opt_in(self):
+        approximate = {'count': 'approximate'}
+        self.assertEqual(
+            self.client.get('/api/recipes/', approximate).data['count'], 100
+        )
+        self.create_recipe(self.author, 'новый рецепт')
+
+        self.assertEqual(
+            self.client.get('/api/recipes/', approximate).data['count'], 100
+        )
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 101)
+
+
+class RecipeIngredientMatchTest(RecipeAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        first, second, third, fourth = cls.ingredients[:4]
+        cls.complete = cls.create_recipe(cls.author, 'все', (first, second))
+        cls.one_missing = cls.create_recipe(
+            cls.author, 'без одного', (first, second, third)
+        )
+        cls.two_missing = cls.create_recipe(
+            cls.author, 'без двух', (first, third, fourth)
+        )
+        cls.unrelated = cls.create_recipe(cls.author, 'другой', (fourth,))
+
+    def test_ranked_by_missing_ingredients(self):
+        first, second = self.ingredients[:2]
+        response = self.client.get(
+            '/api/recipes/by_ingredients/',
+            {'ingredients': f'{first.id},{second.id}'},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(
+            [recipe['id'] for recipe in results],
+            [self.complete.id, self.one_missing.id, self.two_missing.id],
+        )
+        self.assertEqual(
+            [len(recipe['missing_ingredients']) for recipe in results],
+            [0, 1, 2],
+        )
+
+    def test_invalid_ingredients(self):
+        response = self.client.get(
+            '/api/recipes/by_ingredients/', {'ingredients': 'x'}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_rank_uses_strpos_on_postgresql(self):
+        queryset = rank_by_position(Recipe.objects.all(), [3, 1, 2])
+        position = queryset.query.annotations[RANK_KEY].lhs
+        sql, params = position.as_postgresql(
+            queryset.query.get_compiler(connection=connection), connection
+        )
+
+        self.assertTrue(sql.startswith('STRPOS('))
+        self.assertIn(',3,1,2,', params)
+
+
+class ShoppingCartAggregateTest(RecipeAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.soup = cls.create_recipe(
+            cls.author, 'суп', cls.ingredients[:3], amount=10
+        )
+        cls.salad = cls.create_recipe(
+            cls.author, 'салат', cls.ingredients[2:5], amount=5
+        )
+
+    def test_api_add_and_remove(self):
+        for recipe in (self.soup, self.salad):
+            response = self.client.post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_cart_amounts(self.user)[
+            self.ingredients[2].id
+        ], 15)
+        self.assertCartConsistent(self.user)
+
+        response = self.client.delete(
+            f'/api/recipes/{self.soup.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertCartConsistent(self.user)
+
+    def test_model_changes_outside_api(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingList.objects.create(user=self.user, recipe=self.soup)
+            ShoppingList.objects.create(user=self.user, recipe=self.salad)
+        self.assertCartConsistent(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_ingredient = self.soup.recipe_ingredient.first()
+            recipe_ingredient.amount = 100
+            recipe_ingredient.save()
+            self.salad.recipe_ingredient.last().delete()
+        self.assertCartConsistent(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soup.delete()
+        self.assertCartConsistent(self.user)
+
+    def test_recipe_cache_refreshed_outside_api(self):
+        path = f'/api/recipes/{self.soup.id}/'
+        self.client.get(path)
+        recipe_ingredient = self.soup.recipe_ingredient.first()
+        recipe_ingredient.amount = 50
+        recipe_ingredient.save()
+
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in self.client.get(path).data['ingredients']
+        }
+        self.assertEqual(amounts[recipe_ingredient.ingredient_id], 50)
+
+        recipe_ingredient.delete()
+        ingredients = self.client.get(path).data['ingredients']
+        self.assertNotIn(
+            recipe_ingredient.ingredient_id,
+            [ingredient['id'] for ingredient in ingredients],
+        )
+
+    def test_author_deletion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingList.objects.create(user=self.user, recipe=self.soup)
+        self.assertNotEqual(self.get_cart_amounts(self.user), {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.delete()
+        self.assertEqual(self.get_cart_amounts(self.user), {})
+
+    def test_rebuild_command(self):
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=self.user, recipe=recipe)
+            for recipe in (self.soup, self.salad)
+        )
+        ShoppingCartIngredient.objects.create(
+            user=self.author, ingredient=self.ingredients[0], amount=1
+        )
+
+        call_command('rebuild_shopping_carts', stdout=StringIO())
+
+        self.assertCartConsistent(self.user)
+        self.assertCartConsistent(self.author)
+
+
+class RecipeSaveTest(RecipeAPITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def get_data(self, ingredients, amount=1):
+        return {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in ingredients
+            ],
+            'tags': [tag.id for tag in self.tags],
+            'image': IMAGE,
+            'name': 'рецепт',
+            'text': 'описание',
+            'cooking_time': 5,
+        }
+
+    def test_create_query_count(self):
+        with self.assertNumQueries(14):
+            response = self.client.post(
+                '/api/recipes/',
+                self.get_data(self.ingredients[:30]),
+                format='json',
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(RecipeIngredient.objects.count(), 30)
+
+    def test_update_query_count(self):
+        recipe = self.create_recipe(
+            self.user, 'рецепт', self.ingredients[:30], self.tags
+        )
+
+        with self.assertNumQueries(20):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/',
+                self.get_data(self.ingredients[10:40], amount=2),
+                format='json',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(
+                recipe.recipe_ingredient.values_list('ingredient_id', 'amount')
+            ),
+            {ingredient.id: 2 for ingredient in self.ingredients[10:40]},
+        )
+
+    def test_update_changes_cart_amounts(self):
+        recipe = self.create_recipe(
+            self.user, 'рецепт', self.ingredients[:2], amount=10
+        )
+        self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            self.get_data(self.ingredients[1:3], amount=100),
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.get_cart_amounts(self.user),
+            {
+                self.ingredients[1].id: 100,
+                self.ingredients[2].id: 100,
+            },
+        )
+        self.assertCartConsistent(self.user)
+
+
+class IngredientSearchTest(RecipeAPITestCase):
+    def test_prefix_matches_first(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        Ingredient.objects.create(name='морская соль', measurement_unit='г')
+
+        response = self.client.get('/api/ingredients/', {'name': 'сол'})
+
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            ['соль', 'морская соль'],
+        )
+
+    def test_results_limited(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(40, 60)
+        )
+        Ingredient.objects.create(name='нут', measurement_unit='г')
+
+        response = self.client.get('/api/ingredients/', {'name': 'ингр'})
+        self.assertEqual(len(response.data), INGREDIENT_SEARCH_LIMIT)
+
+        names = [row['name'] for row in ingredient_index.search('н', 3)]
+        self.assertEqual(names[0], 'нут')
+        self.assertEqual(len(names), 3)
+
+
+class RecipeFilterTest(RecipeAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.favorite = cls.create_recipe(
+            cls.author, 'избранный', tags=cls.tags
+        )
+        cls.other = cls.create_recipe(cls.author, 'другой', tags=cls.tags)
+        FavoriteList.objects.create(user=cls.user, recipe=cls.favorite)
+
+    def test_not_favorited_uses_not_exists(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/', {'is_favorited': 0})
+
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [self.other.id],
+        )
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertIn('NOT EXISTS', sql)
+        self.assertNotIn('NOT IN', sql)
+
+    @skipUnless(connection.vendor == 'postgresql', 'нужен PostgreSQL')
+    def test_list_filters_use_unique_index(self):
+        request = RequestFactory().get('/api/recipes/')
+        request.user = self.user
+        with connection.cursor() as cursor:
+            # На нескольких строках планировщик и так выбрал бы Seq Scan.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for name, model, index in (
+            ('is_favorited', FavoriteList, 'unique_favorite'),
+            ('is_in_shopping_cart', ShoppingList, 'unique_shopping'),
+        ):
+            for value in ('1', '0'):
+                with self.subTest(name=name, value=value):
+                    plan = RecipeFilter(
+                        {name: value}, Recipe.objects.all(), request=request
+                    ).qs.explain()
+                    self.assertIn(index, plan)
+                    self.assertNotIn(
+                        f'Seq Scan on {model._meta.db_table}', plan
+                    )
+
+    def test_anonymous_combined_with_other_filters(self):
+        response = APIClient().get(
+            '/api/recipes/',
+            {
+                'is_favorited': 1,
+                'tags': [self.tags[0].slug, self.tags[1].slug],
+                'author': self.author.id,
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['results'], [])
+
+
+class FeedTest(RecipeAPITestCase):
+    def setUp(self):
+        super().setUp()
+        Follow.objects.create(user=self.user, author=self.author)
+
+    def get_feed_ids(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def get_entries(self, user):
+        return list(
+            FeedEntry.objects.filter(user=user)
+            .order_by('-recipe_id')
+            .values_list('recipe_id', flat=True)
+        )
+
+    @mock.patch('api.signals.needs_processing', return_value=False)
+    def create_published_recipe(self, name, needs_processing):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe(self.author, name)
+        recipe.refresh_from_db()
+        return recipe
+
+    def test_fan_out_on_create(self):
+        recipe = self.create_published_recipe('рецепт')
+
+        self.assertTrue(recipe.in_feeds)
+        self.assertEqual(self.get_entries(self.user), [recipe.id])
+        self.assertEqual(self.get_feed_ids(), [recipe.id])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_over_limit_author_read_on_demand(self):
+        recipe = self.create_published_recipe('рецепт')
+
+        self.assertFalse(recipe.in_feeds)
+        self.assertEqual(self.get_entries(self.user), [])
+        self.assertEqual(self.get_feed_ids(), [recipe.id])
+
+    def test_subscribe_and_unsubscribe(self):
+        recipe = self.create_published_recipe('рецепт')
+        follower = self.create_user('follower')
+        client = self.auth_client(follower)
+
+        response = client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_entries(follower), [recipe.id])
+
+        response = client.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_entries(follower), [])
+        self.assertEqual(
+            client.get('/api/recipes/feed/').data['results'], []
+        )
+
+    @override_settings(FEED_MAX_LENGTH=2)
+    def test_trim_feeds(self):
+        recipes = [
+            self.create_published_recipe(f'рецепт {i}') for i in range(3)
+        ]
+
+        call_command('trim_feeds', stdout=StringIO())
+
+        self.assertEqual(
+            self.get_entries(self.user), [recipes[2].id, recipes[1].id]
+        )
+
+    def test_backfill_feeds(self):
+        old_recipes = [
+            self.create_recipe(self.author, f'рецепт {i}') for i in range(2)
+        ]
+        popular = self.create_user('popular')
+        popular_recipe = self.create_recipe(popular, 'популярный')
+        for i in range(2):
+            Follow.objects.create(
+                user=self.create_user(f'fan{i}'), author=popular
+            )
+
+        with override_settings(FEED_FANOUT_LIMIT=1):
+            call_command('backfill_feeds', stdout=StringIO())
+
+        self.assertEqual(
+            self.get_entries(self.user),
+            [recipe.id for recipe in reversed(old_recipes)],
+        )
+        self.assertFalse(
+            Recipe.objects.filter(
+                author=self.author, in_feeds=False
+            ).exists()
+        )
+        popular_recipe.refresh_from_db()
+        self.assertFalse(popular_recipe.in_feeds)
+        self.assertFalse(FeedEntry.objects.filter(recipe=popular_recipe))
+
+
+class RecipeIndexTest(RecipeAPITestCase):
+    def test_delete_and_late_commit_between_refreshes(self):
+        """
+        Число рецептов не меняется: один удалён, а другой закоммичен позже
+        окна переиндексации, поэтому его не находит выборка по updated_at.
+        """
+        search_index = RecipeSearchIndex(recipe_index_cache)
+        ingredient_index = RecipeIngredientIndex(recipe_index_cache)
+        ingredient = self.ingredients[0]
+        deleted = self.create_recipe(self.author, 'суп старый', (ingredient,))
+        self.create_recipe(self.author, 'салат')
+        self.assertEqual(
+            [pk for pk, _ in search_index.search('суп')], [deleted.id]
+        )
+        self.assertEqual(
+            [pk for pk, *_ in ingredient_index.match((ingredient.id,))],
+            [deleted.id],
+        )
+
+        deleted.delete()
+        late = self.create_recipe(self.author, 'суп новый', (ingredient,))
+        Recipe.objects.filter(id=late.id).update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+        recipe_index_cache.invalidate()
+
+        self.assertEqual(
+            [pk for pk, _ in search_index.search('суп')], [late.id]
+        )
+        self.assertEqual(
+            [pk for pk, *_ in ingredient_index.match((ingredient.id,))],
+            [late.id],
+        )
+
+
+class RecipeListsTest(RecipeAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = [
+            cls.create_recipe(
+                cls.author, f'рецепт {i}', cls.ingredients[i:i + 3], amount=10
+            )
+            for i in range(3)
+        ]
+
+    def get_counters(self, field):
+        return list(
+            Recipe.objects.filter(
+                id__in=[recipe.id for recipe in self.recipes]
+            )
+            .order_by('id')
+            .values_list(field, flat=True)
+        )
+
+    def test_double_post(self):
+        recipe = self.recipes[0]
+        for path, field in (
+            (f'/api/recipes/{recipe.id}/favorite/', 'favorites_count'),
+            (f'/api/recipes/{recipe.id}/shopping_cart/', 'in_carts_count'),
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.post(path).status_code, 201)
+                self.assertEqual(self.client.post(path).status_code, 400)
+                self.assertEqual(self.get_counters(field), [1, 0, 0])
+        self.assertCartConsistent(self.user)
+
+    def test_delete_missing(self):
+        recipe = self.recipes[0]
+        for name in ('favorite', 'shopping_cart'):
+            with self.subTest(name=name):
+                response = self.client.delete(
+                    f'/api/recipes/{recipe.id}/{name}/'
+                )
+                self.assertEqual(response.status_code, 400)
+                response = self.client.delete(f'/api/recipes/0/{name}/')
+                self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.get_counters('favorites_count'), [0, 0, 0])
+        self.assertEqual(self.get_counters('in_carts_count'), [0, 0, 0])
+
+    def test_bulk_favorite(self):
+        first, second, third = [recipe.id for recipe in self.recipes]
+        path = '/api/recipes/favorite/'
+
+        response = self.client.post(
+            path, {'recipes': [first, second, first]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_counters('favorites_count'), [1, 1, 0])
+
+        response = self.client.delete(
+            path, {'recipes': [first, third]}, format='json'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_counters('favorites_count'), [0, 1, 0])
+
+    def test_bulk_shopping_cart(self):
+        first, second, third = [recipe.id for recipe in self.recipes]
+        path = '/api/recipes/shopping_cart/'
+
+        response = self.client.post(
+            path, {'recipes': [first, second]}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_counters('in_carts_count'), [1, 1, 0])
+        self.assertCartConsistent(self.user)
+
+        response = self.client.delete(
+            path, {'recipes': [first]}, format='json'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_counters('in_carts_count'), [0, 1, 0])
+        self.assertCartConsistent(self.user)
+
+        response = self.client.post(
+            f'{path}replace/', {'recipes': [first, third]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_counters('in_carts_count'), [1, 0, 1])
+        self.assertCartConsistent(self.user)
+        self.assertEqual(
+            set(
+                ShoppingList.objects.filter(user=self.user).values_list(
+                    'recipe_id', flat=True
+                )
+            ),
+            {first, third},
+        )
+
+    def test_reconcile_counters(self):
+        recipe = self.recipes[0]
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        Recipe.objects.filter(id=recipe.id).update(
+            favorites_count=5, in_carts_count=2
+        )
+
+        call_command('reconcile_recipe_counters', stdout=StringIO())
+
+        self.assertEqual(self.get_counters('favorites_count'), [1, 0, 0])
+        self.assertEqual(self.get_counters('in_carts_count'), [0, 0, 0])
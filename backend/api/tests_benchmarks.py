@@ -0,0 +1,251 @@
+"""
+Нагрузочные проверки API рецептов на больших объёмах данных.
+
+Запускаются только при заданной переменной окружения RUN_BENCHMARKS:
+
+    RUN_BENCHMARKS=1 python manage.py test api.tests_benchmarks
+
+Число рецептов задаётся BENCHMARK_RECIPES (по умолчанию 100000), число
+ингредиентов в корзине — BENCHMARK_CART_INGREDIENTS (по умолчанию 500).
+"""
+import os
+import statistics
+import time
+import unittest
+
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingList,
+    Tag,
+)
+from users.models import User
+from .utils import rebuild_shopping_cart_ingredients
+
+BENCHMARK_RECIPES = int(os.getenv('BENCHMARK_RECIPES', 100000))
+BATCH_SIZE = 5000
+PAGE_SIZE = 6
+SEARCH_TARGET_MS = 50
+SEARCH_RUNS = 5
+CART_INGREDIENTS = int(os.getenv('BENCHMARK_CART_INGREDIENTS', 500))
+WORDS = (
+    'суп',
+    'салат',
+    'курица',
+    'рыба',
+    'говядина',
+    'сыр',
+    'томаты',
+    'грибы',
+    'рис',
+    'картофель',
+)
+
+
+@unittest.skipUnless(os.getenv('RUN_BENCHMARKS'), 'RUN_BENCHMARKS не задан')
+class BenchmarkTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            first_name='user',
+            last_name='user',
+            password='password-12345',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def timed_get(self, path, params):
+        started = time.perf_counter()
+        response = self.client.get(path, params)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.assertEqual(response.status_code, 200)
+        return response, elapsed
+
+    def report(self, name, elapsed):
+        print(f'\n{name}: {elapsed:.1f} ms', end='')
+
+
+class RecipeBenchmarkTestCase(BenchmarkTestCase):
+    """Общие данные: BENCHMARK_RECIPES рецептов с пятью тегами каждый."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(5)
+        ]
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=cls.user,
+                    name=cls.get_recipe_name(i),
+                    text=cls.get_recipe_text(i),
+                    image='recipes/images/test.jpg',
+                    cooking_time=10,
+                )
+                for i in range(BENCHMARK_RECIPES)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.id)
+                for recipe_id in Recipe.objects.values_list('id', flat=True)
+                for tag in cls.tags
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+    @classmethod
+    def get_recipe_name(cls, number):
+        return (
+            f'{WORDS[number % len(WORDS)]} '
+            f'{WORDS[number // len(WORDS) % len(WORDS)]} {number}'
+        )
+
+    @classmethod
+    def get_recipe_text(cls, number):
+        return f'Описание: {WORDS[number // len(WORDS) ** 2 % len(WORDS)]}'
+
+
+class TagFilterBenchmark(RecipeBenchmarkTestCase):
+    def test_tag_filter_pages_have_no_duplicates(self):
+        for tags in (['tag0'], ['tag0', 'tag1', 'tag2']):
+            seen = []
+            for page in (1, 2, 50):
+                response, elapsed = self.timed_get(
+                    '/api/recipes/',
+                    {'tags': tags, 'page': page, 'limit': PAGE_SIZE},
+                )
+                self.report(
+                    f'{len(tags)} tag(s), page {page}, '
+                    f'{BENCHMARK_RECIPES} recipes',
+                    elapsed,
+                )
+                self.assertEqual(response.data['count'], BENCHMARK_RECIPES)
+                seen.extend(
+                    recipe['id'] for recipe in response.data['results']
+                )
+
+            self.assertEqual(len(seen), len(set(seen)))
+            self.assertEqual(len(seen), 3 * PAGE_SIZE)
+
+
+class SearchBenchmark(RecipeBenchmarkTestCase):
+    def assertSearchResults(self, response, query):
+        results = response.data['results']
+        self.assertTrue(response.data['count'])
+        self.assertEqual(len(results), PAGE_SIZE)
+        for recipe in results:
+            document = f'{recipe["name"]} {recipe["text"]}'.lower()
+            for word in query.split():
+                self.assertIn(word, document)
+
+    def test_search(self):
+        query = 'суп курица'
+        params = {'search': query, 'limit': PAGE_SIZE}
+        response, elapsed = self.timed_get('/api/recipes/', params)
+        self.report(
+            f'search {query!r} (cold, builds the index), '
+            f'{BENCHMARK_RECIPES} recipes',
+            elapsed,
+        )
+        self.assertSearchResults(response, query)
+
+        timings = []
+        for _ in range(SEARCH_RUNS):
+            response, elapsed = self.timed_get('/api/recipes/', params)
+            self.assertSearchResults(response, query)
+            timings.append(elapsed)
+        elapsed = statistics.median(timings)
+        self.report(
+            f'search {query!r} (warm, median of {SEARCH_RUNS}), '
+            f'{BENCHMARK_RECIPES} recipes',
+            elapsed,
+        )
+        self.assertLess(elapsed, SEARCH_TARGET_MS)
+
+
+class ShoppingCartBenchmark(BenchmarkTestCase):
+    """Выгрузка корзины из CART_INGREDIENTS ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(CART_INGREDIENTS)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.user,
+                name=f'рецепт {i}',
+                text='описание',
+                image='recipes/images/test.jpg',
+                cooking_time=10,
+            )
+            for i in range(CART_INGREDIENTS // 10)
+        )
+        ingredients = Ingredient.objects.order_by('id')
+        recipes = Recipe.objects.order_by('id')
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=i)
+            for i, (recipe, ingredient) in enumerate(
+                zip(
+                    (recipe for recipe in recipes for _ in range(10)),
+                    ingredients,
+                )
+            )
+        )
+        ShoppingList.objects.bulk_create(
+            ShoppingList(user=cls.user, recipe=recipe) for recipe in recipes
+        )
+        rebuild_shopping_cart_ingredients((cls.user.id,))
+
+    def download(self, file_format):
+        started = time.perf_counter()
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': file_format}
+        )
+        self.assertEqual(response.status_code, 200)
+        chunks = iter(response.streaming_content)
+        first = next(chunks)
+        first_byte = (time.perf_counter() - started) * 1000
+        content = b''.join((first, *chunks))
+        elapsed = (time.perf_counter() - started) * 1000
+        self.report(
+            f'{file_format}, {CART_INGREDIENTS} ingredients, first byte',
+            first_byte,
+        )
+        self.report(
+            f'{file_format}, {CART_INGREDIENTS} ingredients, '
+            f'{len(content)} bytes',
+            elapsed,
+        )
+        return content
+
+    def test_txt(self):
+        content = self.download('txt').decode()
+        self.assertEqual(len(content.splitlines()), CART_INGREDIENTS)
+
+    def test_csv(self):
+        content = self.download('csv').decode()
+        self.assertEqual(len(content.splitlines()), CART_INGREDIENTS + 1)
+
+    def test_pdf(self):
+        content = self.download('pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertIn(b'%%EOF', content[-32:])
@@ -1,4 +1,38 @@
-from recipes.models import RecipeIngredient
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (
+    BooleanField,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Sum,
+    Value,
+    prefetch_related_objects,
+)
+
+from recipes.models import (
+    FavoriteList,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCartIngredient,
+    ShoppingList,
+    Tag,
+)
+from users.models import Follow
+
+User = get_user_model()
+
+RECIPE_COUNTERS = {
+    FavoriteList: 'favorites_count',
+    ShoppingList: 'in_carts_count',
+}
+
+_shopping_carts_state = threading.local()
 
 
 def is_favorited(request, recipe_id):
@@ -23,23 +57,279 @@ def is_in_shopping_cart(request, recipe_id):
     )
 
 
-def get_ingredients_from_shopping_cart(user):
-    recipes_id = user.shopping.values_list('recipe_id', flat=True)
-    recipes_ingredients = RecipeIngredient.objects.filter(
-        recipe_id__in=recipes_id
-    )
-    amount_index = 2
-
-    ingredients = {}
-    for i in recipes_ingredients:
-        if ingredients.get(i.ingredient) is None:
-            ingredients[i.ingredient] = i.amount
-            ingredients[i.ingredient] = [
-                i.ingredient.name,
-                i.ingredient.measurement_unit,
-                i.amount,
-            ]
+def annotate_user_flags(queryset, user):
+    """
+    Добавляем к рецептам признаки нахождения в избранном и в корзине
+    пользователя и подписки на автора, чтобы не проверять их отдельным
+    запросом для каждого рецепта.
+    """
+    if not user.is_authenticated:
+        return queryset.annotate(
+            is_favorited=Value(False, output_field=BooleanField()),
+            is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            is_author_subscribed=Value(False, output_field=BooleanField()),
+        )
+
+    return queryset.annotate(
+        is_favorited=Exists(
+            FavoriteList.objects.filter(user_id=user.id, recipe=OuterRef('pk'))
+        ),
+        is_in_shopping_cart=Exists(
+            ShoppingList.objects.filter(user_id=user.id, recipe=OuterRef('pk'))
+        ),
+        is_author_subscribed=Exists(
+            Follow.objects.filter(
+                user_id=user.id, author=OuterRef('author_id')
+            )
+        ),
+    )
+
+
+def prefetch_recipe_related(recipes):
+    """
+    Подгружаем теги, автора и ингредиенты рецептов фиксированным числом
+    запросов, выбирая только выводимые в RecipeSerializer поля.
+    """
+    prefetch_related_objects(
+        recipes,
+        Prefetch(
+            'tags',
+            queryset=Tag.objects.only('id', 'name', 'color', 'slug'),
+        ),
+        Prefetch(
+            'author',
+            queryset=User.objects.only(
+                'id', 'email', 'username', 'first_name', 'last_name'
+            ),
+        ),
+        Prefetch(
+            'recipe_ingredient',
+            queryset=RecipeIngredient.objects.select_related(
+                'ingredient'
+            ).only(
+                'recipe',
+                'amount',
+                'ingredient__name',
+                'ingredient__measurement_unit',
+            ),
+        ),
+    )
+
+
+def get_recipes_etag(request, recipes, *extra):
+    """
+    Вычисляем ETag выдачи рецептов без сериализации: по времени изменения
+    рецептов и признакам, зависящим от пользователя.
+    """
+    hasher = hashlib.md5(
+        f'{request.user.id}:{request.get_full_path()}:{extra}'.encode()
+    )
+    for recipe in recipes:
+        hasher.update(
+            f'{recipe.id}:{recipe.updated_at.timestamp()}:'
+            f'{recipe.is_favorited}:{recipe.is_in_shopping_cart}:'
+            f'{recipe.is_author_subscribed};'.encode()
+        )
+
+    return f'"{hasher.hexdigest()}"'
+
+
+def get_recipe_amounts(recipe_id):
+    """Получаем словарь {id ингредиента: количество} для рецепта."""
+    return dict(
+        RecipeIngredient.objects.filter(recipe_id=recipe_id).values_list(
+            'ingredient_id', 'amount'
+        )
+    )
+
+
+def get_recipes_amounts(recipes_id):
+    """Суммируем количества ингредиентов нескольких рецептов."""
+    if not recipes_id:
+        return {}
+
+    return dict(
+        RecipeIngredient.objects.filter(recipe_id__in=recipes_id)
+        .order_by()
+        .values('ingredient_id')
+        .annotate(total_amount=Sum('amount'))
+        .values_list('ingredient_id', 'total_amount')
+    )
+
+
+def get_amounts_difference(old_amounts, new_amounts):
+    """Вычисляем изменение количества ингредиентов рецепта."""
+    return {
+        ingredient_id: new_amounts.get(ingredient_id, 0)
+        - old_amounts.get(ingredient_id, 0)
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+
+
+def lock_users(users_id):
+    """Блокируем строки пользователей до конца транзакции."""
+    list(
+        User.objects.select_for_update()
+        .filter(id__in=users_id)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+@contextmanager
+def updating_shopping_carts():
+    """
+    Блок, в котором агрегат корзин меняется явно. Сигналы изменения
+    корзины и ингредиентов рецептов внутри него агрегат не пересчитывают.
+    """
+    _shopping_carts_state.depth = getattr(_shopping_carts_state, 'depth', 0)
+    _shopping_carts_state.depth += 1
+    try:
+        yield
+    finally:
+        _shopping_carts_state.depth -= 1
+
+
+def is_updating_shopping_carts():
+    return getattr(_shopping_carts_state, 'depth', 0) > 0
+
+
+@transaction.atomic
+def rebuild_shopping_cart_ingredients(users_id):
+    """
+    Пересчитываем агрегат корзин пользователей заново по ShoppingList и
+    ингредиентам рецептов.
+    """
+    users_id = sorted(set(users_id))
+    if not users_id:
+        return
+
+    lock_users(users_id)
+    ShoppingCartIngredient.objects.filter(user_id__in=users_id).delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        ShoppingCartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount
+        )
+        for user_id, ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe__shopping__user_id__in=users_id
+        )
+        .values_list('recipe__shopping__user_id', 'ingredient_id')
+        .annotate(total=Sum('amount'))
+        .values_list('recipe__shopping__user_id', 'ingredient_id', 'total')
+        .order_by()
+    )
+
+
+@transaction.atomic
+def change_shopping_cart_ingredients(users_id, amounts, sign=1):
+    """
+    Изменяем суммарные количества ингредиентов в корзинах пользователей
+    на величины из amounts, умноженные на sign. Строки с нулевым
+    количеством удаляем.
+    """
+    amounts = {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in amounts.items()
+        if amount
+    }
+    users_id = list(users_id)
+    if not amounts or not users_id:
+        return
+
+    # Блокируем пользователей: строк агрегата может ещё не быть, и без
+    # блокировки параллельные запросы вставили бы одну строку дважды.
+    lock_users(users_id)
+    existing = ShoppingCartIngredient.objects.filter(
+        user_id__in=users_id, ingredient_id__in=amounts
+    )
+    found = set()
+    to_update = []
+    to_delete = []
+    for cart_ingredient in existing:
+        found.add((cart_ingredient.user_id, cart_ingredient.ingredient_id))
+        cart_ingredient.amount += amounts[cart_ingredient.ingredient_id]
+        if cart_ingredient.amount > 0:
+            to_update.append(cart_ingredient)
         else:
-            ingredients[i.ingredient][amount_index] += i.amount
+            to_delete.append(cart_ingredient.id)
+
+    ShoppingCartIngredient.objects.bulk_update(to_update, ('amount',))
+    ShoppingCartIngredient.objects.filter(id__in=to_delete).delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        ShoppingCartIngredient(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount
+        )
+        for user_id in users_id
+        for ingredient_id, amount in amounts.items()
+        if amount > 0 and (user_id, ingredient_id) not in found
+    )
+
+
+def get_ingredients_from_shopping_cart(user):
+    """
+    Получаем суммарное количество ингредиентов в корзине пользователя из
+    заранее рассчитанной таблицы ShoppingCartIngredient.
+    """
+    return (
+        ShoppingCartIngredient.objects.filter(user_id=user.id)
+        .values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            total_amount=F('amount'),
+        )
+        .order_by('ingredient__name')
+    )
+
+
+def change_recipe_counter(recipes_id, model, delta):
+    """
+    Атомарно меняем счётчик рецептов одним UPDATE с F-выражением.
+    update() не трогает updated_at, поэтому кэш рецепта не сбрасывается.
+    Счётчик не уходит ниже нуля, даже если он разошёлся с данными.
+    """
+    field = RECIPE_COUNTERS[model]
+    recipes = Recipe.objects.filter(id__in=recipes_id)
+    if delta < 0:
+        recipes = recipes.filter(**{f'{field}__gte': -delta})
+
+    recipes.update(**{field: F(field) + delta})
+
+
+@transaction.atomic
+@updating_shopping_carts()
+def change_recipe_list(user, model, add=(), remove=(), replace=False):
+    """
+    Пакетно добавляем и удаляем рецепты в избранном или корзине
+    пользователя. При replace=True в списке остаются только рецепты из add.
+    Возвращаем множества добавленных и удалённых id.
+    """
+    # Блокируем пользователя, чтобы параллельные пакетные запросы
+    # не посчитали одни и те же строки дважды.
+    lock_users((user.id,))
+    add, remove = set(add), set(remove)
+    existing = model.objects.filter(user_id=user.id)
+    if not replace:
+        existing = existing.filter(recipe_id__in=add | remove)
+    existing = set(existing.values_list('recipe_id', flat=True))
+
+    added = add - existing
+    removed = existing - add if replace else existing & remove
+    if removed:
+        model.objects.filter(user_id=user.id, recipe_id__in=removed).delete()
+        change_recipe_counter(removed, model, -1)
+    if added:
+        model.objects.bulk_create(
+            (model(user_id=user.id, recipe_id=pk) for pk in added),
+            ignore_conflicts=True,
+        )
+        change_recipe_counter(added, model, 1)
+
+    if model is ShoppingList:
+        change_shopping_cart_ingredients(
+            (user.id,),
+            get_amounts_difference(
+                get_recipes_amounts(removed), get_recipes_amounts(added)
+            ),
+        )
 
-    return ingredients.values()
+    return added, removed
@@ -1,6 +1,10 @@
-from django.db.models import Q
-from django.http import HttpResponse
+from itertools import chain
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
@@ -8,23 +12,44 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from recipes.feeds import get_feed
 from recipes.models import FavoriteList, Ingredient, Recipe, ShoppingList, Tag
-from users.paginations import CustomPageNumberPagination
+from users.paginations import (
+    RecipeCursorPagination,
+    RecipePageNumberPagination,
+)
+from users.utils import insert_ignore
 from . import serializers
+from .cache import ingredients_cache, tags_cache
 from .exceptions import (
     EmptyShoppingCart,
     FavoriteException,
     ShoppingCartException,
 )
-from .filters import RecipeFilter, IngredientFilter
+from .filters import (
+    IngredientFilter,
+    RecipeFilter,
+    RecipeIngredientMatchFilter,
+    RecipeOrderingFilter,
+    RecipeSearchFilter,
+)
+from .indexes import ingredient_index
 from .permissions import AuthorOrAdminOrReadOnly
+from .renderers import SHOPPING_CART_RENDERERS
 from .utils import (
+    annotate_user_flags,
+    change_recipe_counter,
+    change_recipe_list,
+    change_shopping_cart_ingredients,
     get_ingredients_from_shopping_cart,
-    is_favorited,
-    is_in_shopping_cart,
+    get_recipe_amounts,
+    get_recipes_etag,
+    updating_shopping_carts,
 )
 
 
+@method_decorator(tags_cache.condition(), name='list')
+@method_decorator(tags_cache.condition(), name='retrieve')
 class TagsViewSet(ReadOnlyModelViewSet):
     """Представление для вывода списка и экземпляра тега."""
 
@@ -32,7 +57,16 @@ class TagsViewSet(ReadOnlyModelViewSet):
     serializer_class = serializers.TagSerializer
     permission_classes = (AllowAny,)
 
+    def list(self, request, *args, **kwargs):
+        return Response(
+            tags_cache.get_or_set(
+                'list', lambda: super(TagsViewSet, self).list(request).data
+            )
+        )
 
+
+@method_decorator(ingredients_cache.condition(), name='list')
+@method_decorator(ingredients_cache.condition(), name='retrieve')
 class IngredientsViewSet(ReadOnlyModelViewSet):
     """Представление для вывода списка и экземпляра ингридиента."""
 
@@ -42,15 +76,35 @@ class IngredientsViewSet(ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend, IngredientFilter)
     search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(IngredientFilter.search_param)
+        if name:
+            return Response(ingredient_index.search(name))
+
+        return Response(
+            ingredients_cache.get_or_set(
+                'list',
+                lambda: super(IngredientsViewSet, self).list(request).data,
+            )
+        )
+
 
 class RecipesViewSet(ModelViewSet):
     """Представление для модели Recipe."""
 
     queryset = Recipe.objects.all()
     permission_classes = (AuthorOrAdminOrReadOnly,)
-    pagination_class = CustomPageNumberPagination
-    filter_backends = (DjangoFilterBackend,)
+    pagination_class = RecipePageNumberPagination
+    cursor_pagination_class = RecipeCursorPagination
+    filter_backends = (
+        DjangoFilterBackend,
+        RecipeSearchFilter,
+        RecipeIngredientMatchFilter,
+        RecipeOrderingFilter,
+    )
     filterset_class = RecipeFilter
+    ordering_fields = ('favorites_count', 'pub_date')
+    ordering = Recipe._meta.ordering
 
     http_method_names = [
         'get',
@@ -62,72 +116,299 @@ class RecipesViewSet(ModelViewSet):
         'trace',
     ]
 
+    @property
+    def paginator(self):
+        """
+        Пагинация по курсору включается параметром ?pagination=cursor,
+        по умолчанию используется постраничная. Лента подписок всегда
+        листается по курсору.
+        """
+        if not hasattr(self, '_paginator'):
+            if (
+                self.action == 'feed'
+                or self.request.query_params.get('pagination') == 'cursor'
+            ):
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+
+        return self._paginator
+
+    def get_queryset(self):
+        if self.action == 'feed':
+            queryset = get_feed(self.request.user)
+        else:
+            queryset = super().get_queryset()
+        if self.action in (
+            'list',
+            'retrieve',
+            'by_ingredients',
+            'feed',
+            'similar',
+        ):
+            return annotate_user_flags(queryset, self.request.user)
+
+        return queryset
+
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action == 'by_ingredients':
+            return serializers.RecipeMatchSerializer
+        if self.action in ('list', 'retrieve', 'feed', 'similar'):
             return serializers.RecipeSerializer
 
         return serializers.CreateRecipeSerializer
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'by_ingredients':
+            context['ingredients_id'] = (
+                RecipeIngredientMatchFilter.get_ingredients_id(self.request)
+            )
+
+        return context
+
+    def _conditional_response(self, request, etag, get_data):
+        """
+        Отвечаем 304, если ETag клиента совпадает, иначе сериализуем
+        данные, вызывая get_data.
+        """
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = get_data()
+
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            recipes = list(queryset)
+            etag = get_recipes_etag(request, recipes)
+            return self._conditional_response(
+                request,
+                etag,
+                lambda: Response(
+                    self.get_serializer(recipes, many=True).data
+                ),
+            )
+
+        etag = get_recipes_etag(
+            request, page, self.get_paginated_response([]).data
+        )
+        return self._conditional_response(
+            request,
+            etag,
+            lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True).data
+            ),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self._conditional_response(
+            request,
+            get_recipes_etag(request, (instance,)),
+            lambda: Response(self.get_serializer(instance).data),
+        )
+
+    @transaction.atomic
+    @updating_shopping_carts()
+    def perform_destroy(self, instance):
+        change_shopping_cart_ingredients(
+            instance.shopping.values_list('user_id', flat=True),
+            get_recipe_amounts(instance.id),
+            sign=-1,
+        )
+        instance.delete()
+
     def _create(self, user, recipe, model):
-        obj = model.objects.create(user=user, recipe=recipe)
-        obj.save()
-        serializer = serializers.ShortRecipesSerializer(recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        """
+        Добавляем рецепт в список одним INSERT ... ON CONFLICT DO NOTHING.
+        Возвращаем False, если рецепт уже был в списке.
+        """
+        created = insert_ignore(model, user=user.id, recipe=recipe.id)
+        if created:
+            change_recipe_counter((recipe.id,), model, 1)
 
-    def _delete(self, user, recipe, model):
-        obj = get_object_or_404(model, user=user, recipe=recipe)
-        obj.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return created
+
+    def _delete(self, user, pk, model):
+        """
+        Удаляем рецепт из списка одним DELETE и возвращаем False,
+        если рецепта в списке не было.
+        """
+        deleted, _ = model.objects.filter(user=user, recipe_id=pk).delete()
+        if deleted:
+            change_recipe_counter((pk,), model, -1)
+
+        return bool(deleted)
+
+    def _created_response(self, recipe):
+        serializer = serializers.ShortRecipesSerializer(
+            recipe, context=self.get_serializer_context()
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(methods=['post'], detail=True)
     def favorite(self, request, pk):
         recipe = get_object_or_404(Recipe, id=pk)
 
-        if is_favorited(request, recipe.id):
-            raise FavoriteException(f'Рецепт {recipe} уже в избранном')
+        with transaction.atomic():
+            if not self._create(request.user, recipe, FavoriteList):
+                raise FavoriteException(f'Рецепт {recipe} уже в избранном')
 
-        return self._create(request.user, recipe, FavoriteList)
+        return self._created_response(recipe)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
+        with transaction.atomic():
+            if self._delete(request.user, pk, FavoriteList):
+                return Response(status=status.HTTP_204_NO_CONTENT)
 
-        if not is_favorited(request, recipe.id):
-            raise FavoriteException(f'Рецепт {recipe} не в избранном')
-
-        return self._delete(request.user, recipe, FavoriteList)
+        recipe = get_object_or_404(Recipe, id=pk)
+        raise FavoriteException(f'Рецепт {recipe} не в избранном')
 
     @action(methods=['post'], detail=True)
     def shopping_cart(self, request, pk):
         recipe = get_object_or_404(Recipe, id=pk)
 
-        if is_in_shopping_cart(request, recipe.id):
-            raise ShoppingCartException(f'Рецепт {recipe} уже в корзине')
+        with transaction.atomic():
+            if not self._create(request.user, recipe, ShoppingList):
+                raise ShoppingCartException(f'Рецепт {recipe} уже в корзине')
+
+            change_shopping_cart_ingredients(
+                (request.user.id,), get_recipe_amounts(recipe.id)
+            )
 
-        return self._create(request.user, recipe, ShoppingList)
+        return self._created_response(recipe)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
+        with transaction.atomic(), updating_shopping_carts():
+            if self._delete(request.user, pk, ShoppingList):
+                change_shopping_cart_ingredients(
+                    (request.user.id,), get_recipe_amounts(pk), sign=-1
+                )
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
         recipe = get_object_or_404(Recipe, id=pk)
+        raise ShoppingCartException(f'Рецепт {recipe} не в корзине')
+
+    def _bulk_change(self, request, model, replace=False):
+        """
+        Пакетно меняем избранное или корзину: POST добавляет рецепты
+        из списка, DELETE удаляет, replace заменяет список целиком.
+        """
+        serializer = serializers.RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = list(
+            {
+                recipe.id: recipe
+                for recipe in serializer.validated_data['recipes']
+            }.values()
+        )
+        recipes_id = [recipe.id for recipe in recipes]
 
-        if not is_in_shopping_cart(request, recipe.id):
-            raise ShoppingCartException(f'Рецепт {recipe} не в корзине')
+        if request.method == 'DELETE':
+            change_recipe_list(request.user, model, remove=recipes_id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-        return self._delete(request.user, recipe, ShoppingList)
+        change_recipe_list(
+            request.user, model, add=recipes_id, replace=replace
+        )
+        serializer = serializers.ShortRecipesSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        return Response(
+            serializer.data,
+            status=status.HTTP_200_OK if replace else status.HTTP_201_CREATED,
+        )
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='favorite',
+        url_name='favorite-bulk',
+        permission_classes=[IsAuthenticated],
+    )
+    def bulk_favorite(self, request):
+        return self._bulk_change(request, FavoriteList)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=[IsAuthenticated],
+    )
+    def bulk_shopping_cart(self, request):
+        return self._bulk_change(request, ShoppingList)
+
+    @action(
+        methods=['post'],
+        detail=False,
+        url_path='shopping_cart/replace',
+        url_name='shopping-cart-replace',
+        permission_classes=[IsAuthenticated],
+    )
+    def replace_shopping_cart(self, request):
+        return self._bulk_change(request, ShoppingList, replace=True)
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        """
+        Похожие рецепты, рассчитанные командой build_similar_recipes,
+        в порядке убывания сходства.
+        """
+        recipes = list(
+            self.get_queryset()
+            .filter(similar_to__recipe_id=pk)
+            .order_by('-similar_to__score', '-id')
+        )
+        if not recipes:
+            get_object_or_404(Recipe, id=pk)
+
+        return self._conditional_response(
+            request,
+            get_recipes_etag(request, recipes),
+            lambda: Response(self.get_serializer(recipes, many=True).data),
+        )
+
+    @action(detail=False)
+    def by_ingredients(self, request):
+        """
+        Рецепты, которые можно приготовить из ингредиентов ?ingredients=:
+        сначала те, для которых есть всё, затем с наименьшим числом
+        недостающих ингредиентов.
+        """
+        return self.list(request)
 
     @action(detail=False, permission_classes=[IsAuthenticated])
-    def download_shopping_cart(self, request):
-        name = 0
-        measure = 1
-        amount = 2
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь."""
+        return self.list(request)
 
-        ingredients = get_ingredients_from_shopping_cart(request.user)
-        if not ingredients:
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_CART_RENDERERS,
+    )
+    def download_shopping_cart(self, request):
+        ingredients = get_ingredients_from_shopping_cart(
+            request.user
+        ).iterator()
+        first = next(ingredients, None)
+        if first is None:
             raise EmptyShoppingCart
 
-        cart = ''
-        ingredients = [*ingredients]
-        for ing in ingredients:
-            cart += f'{ing[name]} ({ing[measure]}) - {ing[amount]} \n'
-
-        return HttpResponse(cart, content_type='text/plain')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(chain((first,), ingredients)),
+            content_type=renderer.content_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.format}"'
+        )
+        return response
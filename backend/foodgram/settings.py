@@ -81,6 +81,28 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех процессов: версии кэшей сбрасываются и из
+# management-команд (например, cvs_ingredients_import), поэтому
+# локальный для процесса LocMemCache здесь не подходит. В docker-compose
+# используется memcached, без него — файловый кэш.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND',
+    default='django.core.cache.backends.filebased.FileBasedCache',
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache')
+        ),
+    }
+}
+if 'memcached' not in CACHE_BACKEND:
+    # Кэш хранит фрагменты всех рецептов, стандартных 300 записей мало.
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -123,9 +145,22 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ),
 }
 
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 60))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'PDF_FONT_PATH',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+
+FEED_MAX_LENGTH = int(os.getenv('FEED_MAX_LENGTH', 500))
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
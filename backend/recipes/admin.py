@@ -1,5 +1,4 @@
 from django.contrib import admin
-from django.db.models import Count
 
 from .models import (
     FavoriteList,
@@ -27,11 +26,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     def quantity_in_favorites(self, obj):
         """Возвращаем общее число добавлений рецепта в избранное."""
-        return obj.in_favorites
-
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(in_favorites=Count('favorites'))
+        return obj.favorites_count
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Subquery
+
+from users.models import Follow
+from .models import FeedEntry, Recipe
+
+BATCH_SIZE = 1000
+
+
+def get_fan_out_followers(author_id):
+    """
+    Получаем id подписчиков автора или None, если их больше
+    FEED_FANOUT_LIMIT: рецепты таких авторов лента получает при чтении.
+    """
+    limit = settings.FEED_FANOUT_LIMIT
+    followers_id = list(
+        Follow.objects.filter(author_id=author_id)
+        .order_by()
+        .values_list('user_id', flat=True)[: limit + 1]
+    )
+    if len(followers_id) > limit:
+        return None
+
+    return followers_id
+
+
+def fan_out_recipe(recipe_id, author_id):
+    """Раскладываем рецепт в ленты подписчиков автора."""
+    followers_id = get_fan_out_followers(author_id)
+    if followers_id is None:
+        return
+
+    with transaction.atomic():
+        FeedEntry.objects.bulk_create(
+            (
+                FeedEntry(user_id=user_id, recipe_id=recipe_id)
+                for user_id in followers_id
+            ),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        Recipe.objects.filter(id=recipe_id).update(in_feeds=True)
+
+
+def backfill_author_feeds(author_id):
+    """
+    Раскладываем FEED_MAX_LENGTH последних рецептов автора в ленты
+    подписчиков и отмечаем все его рецепты разложенными. Возвращаем id
+    подписчиков или None, если их больше FEED_FANOUT_LIMIT.
+    """
+    followers_id = get_fan_out_followers(author_id)
+    if followers_id is None:
+        return None
+
+    with transaction.atomic():
+        recipes_id = list(
+            Recipe.objects.filter(author_id=author_id)
+            .order_by('-id')
+            .values_list('id', flat=True)[: settings.FEED_MAX_LENGTH]
+        )
+        FeedEntry.objects.bulk_create(
+            (
+                FeedEntry(user_id=user_id, recipe_id=recipe_id)
+                for user_id in followers_id
+                for recipe_id in recipes_id
+            ),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        Recipe.objects.filter(author_id=author_id, in_feeds=False).update(
+            in_feeds=True
+        )
+
+    return followers_id
+
+
+def schedule_fan_out(recipe):
+    recipe_id, author_id = recipe.id, recipe.author_id
+    transaction.on_commit(lambda: fan_out_recipe(recipe_id, author_id))
+
+
+def trim_feed(user_id):
+    """Оставляем в ленте пользователя FEED_MAX_LENGTH последних записей."""
+    entries = FeedEntry.objects.filter(user_id=user_id)
+    cutoff = entries.order_by('-recipe_id').values('recipe_id')[
+        settings.FEED_MAX_LENGTH:settings.FEED_MAX_LENGTH + 1
+    ]
+    return entries.filter(recipe_id__lte=Subquery(cutoff)).delete()[0]
+
+
+def add_author_to_feed(user_id, author_id):
+    """Добавляем в ленту новой подписки разложенные рецепты автора."""
+    recipes_id = (
+        Recipe.objects.filter(author_id=author_id, in_feeds=True)
+        .order_by('-id')
+        .values_list('id', flat=True)[: settings.FEED_MAX_LENGTH]
+    )
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in recipes_id
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_feed(user_id)
+
+
+def remove_author_from_feed(user_id, author_id):
+    FeedEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id
+    ).delete()
+
+
+def get_feed(user):
+    """
+    Получаем рецепты авторов, на которых подписан пользователь: разложенные
+    в его ленту и ещё не разложенные, которые читаем напрямую по индексу
+    recipe_feed_pull_idx.
+    """
+    timeline = (
+        FeedEntry.objects.filter(user_id=user.id)
+        .order_by('-recipe_id')
+        .values('recipe_id')[: settings.FEED_MAX_LENGTH]
+    )
+    return Recipe.objects.filter(
+        author__in=Follow.objects.filter(user_id=user.id).values('author')
+    ).filter(Q(in_feeds=False) | Q(id__in=timeline))
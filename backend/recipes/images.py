@@ -0,0 +1,201 @@
+import binascii
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+MAX_IMAGE_PIXELS = 40_000_000
+BASE64_CHUNK_SIZE = 4 * 16 * 1024
+VARIANT_SIZES = {
+    'small': 320,
+    'medium': 960,
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+VARIANT_QUALITY = 80
+VARIANTS_DIR = 'variants'
+
+_executor = None
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def decode_base64_to_file(imgstr):
+    """
+    Декодируем base64 частями во временный файл на диске, не собирая
+    весь файл в памяти.
+    """
+    file = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+    try:
+        for start in range(0, len(imgstr), BASE64_CHUNK_SIZE):
+            file.write(
+                binascii.a2b_base64(
+                    imgstr[start:start + BASE64_CHUNK_SIZE]
+                )
+            )
+    except binascii.Error:
+        file.close()
+        raise InvalidImage('Некорректная строка base64.')
+
+    file.seek(0)
+    return File(file, name='image')
+
+
+def validate_image_header(file):
+    """
+    Проверяем формат и размеры изображения по заголовку файла, не
+    декодируя само изображение. Возвращаем расширение файла.
+    """
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise InvalidImage('Файл не является изображением.')
+    finally:
+        file.seek(0)
+
+    if image_format not in ALLOWED_FORMATS:
+        raise InvalidImage(f'Формат {image_format} не поддерживается.')
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidImage('Слишком большое изображение.')
+
+    return ALLOWED_FORMATS[image_format]
+
+
+def get_variant_formats():
+    if features.check('webp'):
+        return VARIANT_FORMATS
+
+    return {
+        key: value for key, value in VARIANT_FORMATS.items() if key != 'webp'
+    }
+
+
+def build_image_variants(name):
+    """
+    Создаём уменьшенные копии изображения в форматах WebP и JPEG.
+    Возвращаем словарь {размер: {формат: путь в хранилище}}.
+    """
+    root, _ = os.path.splitext(name)
+    directory, base = os.path.split(root)
+    with default_storage.open(name) as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    variants = {}
+    for size, width in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((width, width * 4))
+        variants[size] = {}
+        for key, (image_format, ext) in get_variant_formats().items():
+            buffer = BytesIO()
+            resized.save(
+                buffer, image_format, quality=VARIANT_QUALITY, optimize=True
+            )
+            variants[size][key] = default_storage.save(
+                os.path.join(directory, VARIANTS_DIR, f'{base}_{width}.{ext}'),
+                ContentFile(buffer.getvalue()),
+            )
+
+    return variants
+
+
+def process_recipe_image(recipe_id, name):
+    """
+    Строим копии изображения и сохраняем их в рецепт, если за это время
+    изображение не заменили. updated_at сбрасывает кэш рецепта.
+    """
+    from .models import Recipe
+
+    try:
+        variants = build_image_variants(name)
+    except Exception:
+        # Запоминаем неудачу, чтобы не повторять обработку при каждом
+        # сохранении рецепта.
+        logger.exception('Не удалось обработать изображение %s', name)
+        variants = {}
+
+    Recipe.objects.filter(id=recipe_id, image=name).update(
+        image_variants={'source': name, 'sizes': variants},
+        updated_at=timezone.now(),
+    )
+
+
+def _run_in_thread(recipe_id, name):
+    try:
+        process_recipe_image(recipe_id, name)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None and settings.IMAGE_PROCESSING_WORKERS > 0:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+
+    return _executor
+
+
+def schedule_image_processing(recipe):
+    """
+    После коммита отдаём обработку изображения пулу потоков. Если пул
+    выключен или уже остановлен, обрабатываем изображение синхронно.
+    """
+    recipe_id, name = recipe.id, recipe.image.name
+
+    def submit():
+        executor = get_executor()
+        if executor is not None:
+            try:
+                executor.submit(_run_in_thread, recipe_id, name)
+                return
+            except RuntimeError:
+                pass
+
+        process_recipe_image(recipe_id, name)
+
+    transaction.on_commit(submit)
+
+
+def needs_processing(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name
+    )
+
+
+def get_thumbnail_urls(recipe, request=None):
+    """Получаем ссылки на уменьшенные копии текущего изображения."""
+    variants = recipe.image_variants or {}
+    if not recipe.image or variants.get('source') != recipe.image.name:
+        return {}
+
+    def url(path):
+        path = default_storage.url(path)
+        return request.build_absolute_uri(path) if request else path
+
+    return {
+        size: {key: url(path) for key, path in formats.items()}
+        for size, formats in variants['sizes'].items()
+    }
@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand
+
+from recipes.feeds import backfill_author_feeds, trim_feed
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Раскладка в ленты подписок рецептов, опубликованных до появления '
+        'лент. Авторы, у которых подписчиков больше FEED_FANOUT_LIMIT, '
+        'остаются на чтении из рецептов.'
+    )
+
+    def handle(self, *args, **options):
+        authors_id = list(
+            Recipe.objects.filter(in_feeds=False)
+            .order_by('author_id')
+            .values_list('author_id', flat=True)
+            .distinct()
+        )
+        followers_id = set()
+        skipped = 0
+        for author_id in authors_id:
+            author_followers_id = backfill_author_feeds(author_id)
+            if author_followers_id is None:
+                skipped += 1
+            else:
+                followers_id.update(author_followers_id)
+
+        deleted = sum(trim_feed(user_id) for user_id in followers_id)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Backfill completed: {len(authors_id) - skipped} authors, '
+                f'{len(followers_id)} feeds, {deleted} entries trimmed'
+            )
+        )
@@ -0,0 +1,172 @@
+import heapq
+import math
+import time
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.models import (
+    FavoriteList,
+    Recipe,
+    RecipeIngredient,
+    SimilarRecipe,
+)
+
+TOP_K = 10
+FAVORITES_WEIGHT = 0.5
+MAX_CANDIDATES = 100
+MAX_USER_FAVORITES = 500
+BATCH_SIZE = 1000
+CHUNK_SIZE = 10000
+
+
+def load_favorites():
+    """
+    Получаем списки избранного пользователей и поклонников рецептов.
+    Пользователей с огромным избранным не учитываем: они почти ничего не
+    говорят о сходстве, а их пары растут квадратично.
+    """
+    favorites = defaultdict(list)
+    for user_id, recipe_id in (
+        FavoriteList.objects.order_by()
+        .values_list('user_id', 'recipe_id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    ):
+        favorites[user_id].append(recipe_id)
+
+    fans = defaultdict(list)
+    for user_id, recipes_id in list(favorites.items()):
+        if len(recipes_id) > MAX_USER_FAVORITES:
+            del favorites[user_id]
+            continue
+        for recipe_id in recipes_id:
+            fans[recipe_id].append(user_id)
+
+    return favorites, fans
+
+
+def load_ingredients():
+    """Получаем наборы ингредиентов рецептов и рецепты ингредиентов."""
+    ingredients = defaultdict(set)
+    postings = defaultdict(list)
+    for recipe_id, ingredient_id in (
+        RecipeIngredient.objects.order_by('recipe_id')
+        .values_list('recipe_id', 'ingredient_id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    ):
+        ingredients[recipe_id].add(ingredient_id)
+        postings[ingredient_id].append(recipe_id)
+
+    return ingredients, postings
+
+
+def ingredient_candidates(recipe_ingredients, postings):
+    """
+    Берём до MAX_CANDIDATES рецептов, начиная с самых редких ингредиентов
+    рецепта: совпадение по ним сильнее всего поднимает коэффициент Жаккара.
+    """
+    candidates = set()
+    for ingredient_id in sorted(
+        recipe_ingredients, key=lambda pk: len(postings[pk])
+    ):
+        candidates.update(
+            postings[ingredient_id][: MAX_CANDIDATES - len(candidates)]
+        )
+        if len(candidates) >= MAX_CANDIDATES:
+            break
+
+    return candidates
+
+
+class Command(BaseCommand):
+    help = (
+        'Расчёт похожих рецептов по совместному добавлению в избранное '
+        'и пересечению ингредиентов. Для каждого рецепта сохраняется '
+        'до --top похожих.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=TOP_K)
+        parser.add_argument(
+            '--favorites-weight', type=float, default=FAVORITES_WEIGHT
+        )
+
+    def similar_recipes(self, recipe_id, top, favorites_weight):
+        """
+        Оцениваем кандидатов смесью косинусной близости по избранному и
+        коэффициента Жаккара по ингредиентам.
+        """
+        favorites, norms, ingredients = (
+            self.favorites,
+            self.norms,
+            self.ingredients,
+        )
+        co_favorites = Counter()
+        for user_id in self.fans.get(recipe_id, ()):
+            co_favorites.update(favorites[user_id])
+        co_favorites.pop(recipe_id, None)
+
+        scores = {}
+        if co_favorites:
+            weight = favorites_weight / norms[recipe_id]
+            for pk, count in co_favorites.most_common(MAX_CANDIDATES):
+                scores[pk] = weight * count / norms[pk]
+
+        recipe_ingredients = ingredients.get(recipe_id)
+        if recipe_ingredients:
+            weight = 1 - favorites_weight
+            size = len(recipe_ingredients)
+            for pk in ingredient_candidates(
+                recipe_ingredients, self.postings
+            ).union(scores):
+                other = ingredients.get(pk)
+                if other:
+                    common = len(recipe_ingredients & other)
+                    if common:
+                        scores[pk] = scores.get(pk, 0) + weight * common / (
+                            size + len(other) - common
+                        )
+
+        scores.pop(recipe_id, None)
+        return heapq.nlargest(top, scores.items(), key=itemgetter(1, 0))
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.favorites, self.fans = load_favorites()
+        self.norms = {
+            recipe_id: math.sqrt(len(fans))
+            for recipe_id, fans in self.fans.items()
+        }
+        self.ingredients, self.postings = load_ingredients()
+        loaded = time.monotonic()
+
+        recipes_id = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)
+        )
+        saved = 0
+        for start in range(0, len(recipes_id), BATCH_SIZE):
+            batch = recipes_id[start:start + BATCH_SIZE]
+            similar = [
+                SimilarRecipe(recipe_id=recipe_id, similar_id=pk, score=score)
+                for recipe_id in batch
+                for pk, score in self.similar_recipes(
+                    recipe_id, options['top'], options['favorites_weight']
+                )
+            ]
+            with transaction.atomic():
+                SimilarRecipe.objects.filter(recipe_id__in=batch).delete()
+                SimilarRecipe.objects.bulk_create(
+                    similar, batch_size=BATCH_SIZE
+                )
+            saved += len(similar)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Build completed: {saved} similar recipes for '
+                f'{len(recipes_id)} recipes, data loaded in '
+                f'{loaded - started:.1f} s, '
+                f'total {time.monotonic() - started:.1f} s'
+            )
+        )
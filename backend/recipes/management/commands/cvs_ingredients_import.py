@@ -1,31 +1,103 @@
 import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 
+from api.cache import ingredients_cache
 from recipes.models import Ingredient
 
-DATA_DIR = f'{settings.BASE_DIR}/data/'
+DATA_DIR = Path(settings.BASE_DIR) / 'data'
 FILE_NAME = 'ingredients.csv'
+BATCH_SIZE = 1000
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    for item in json.load(file):
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
 
 
 class Command(BaseCommand):
+    help = (
+        'Импорт ингредиентов из csv- или json-файла. '
+        'Уже существующие ингредиенты пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=DATA_DIR / FILE_NAME,
+            help=f'Путь к файлу, по умолчанию {DATA_DIR / FILE_NAME}',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество ингредиентов в одном INSERT-запросе.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только прочитать файл, не записывая данные в базу.',
+        )
+
     def handle(self, *args, **options):
-        try:
-            with open(f'{DATA_DIR}{FILE_NAME}') as f:
-                table = csv.reader(f)
+        path = Path(options['path'])
+        batch_size = options['batch_size']
+        reader = READERS.get(path.suffix)
+        if reader is None:
+            raise CommandError(f'Неподдерживаемый формат файла {path.name}')
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
 
-                for column in table:
-                    if not Ingredient.objects.filter(
-                        name=column[0], measurement_unit=column[1]
-                    ).exists():
+        rows = 0
+        start = time.perf_counter()
+        try:
+            with open(path, encoding='utf-8') as f:
+                ingredients = reader(f)
+                while True:
+                    batch = [
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in islice(ingredients, batch_size)
+                    ]
+                    if not batch:
+                        break
 
-                        Ingredient.objects.create(
-                            name=column[0], measurement_unit=column[1]
+                    if not options['dry_run']:
+                        Ingredient.objects.bulk_create(
+                            batch, ignore_conflicts=True
                         )
-            print('Import ingredient completed')
+                    rows += len(batch)
 
         except FileNotFoundError:
-            raise FileNotFoundError(
-                f'Файл {FILE_NAME} отсутствует по адресу {DATA_DIR}'
+            raise CommandError(
+                f'Файл {path.name} отсутствует по адресу {path.parent}'
+            )
+
+        if not options['dry_run']:
+            ingredients_cache.invalidate()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Import ingredient completed: {rows} rows in '
+                f'{elapsed:.2f} s ({rows / max(elapsed, 1e-6):.0f} rows/s)'
+                + (', dry run' if options['dry_run'] else '')
             )
+        )
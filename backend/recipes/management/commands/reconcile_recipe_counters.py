@@ -0,0 +1,67 @@
+from django.core.management import BaseCommand
+from django.db.models import (
+    Count,
+    F,
+    OuterRef,
+    PositiveIntegerField,
+    Q,
+    Subquery,
+)
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteList, Recipe, ShoppingList
+
+COUNTERS = {
+    'favorites_count': FavoriteList,
+    'in_carts_count': ShoppingList,
+}
+BATCH_SIZE = 1000
+
+
+def count_subquery(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(recipe=OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(count=Count('pk'))
+            .values('count'),
+            output_field=PositiveIntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт счётчиков избранного и корзины у рецептов. '
+        'Обновляются только рецепты с расхождениями.'
+    )
+
+    def handle(self, *args, **options):
+        mismatch = Q()
+        for field in COUNTERS:
+            mismatch |= ~Q(**{field: F(f'actual_{field}')})
+        recipes_id = list(
+            Recipe.objects.annotate(
+                **{
+                    f'actual_{field}': count_subquery(model)
+                    for field, model in COUNTERS.items()
+                }
+            )
+            .filter(mismatch)
+            .values_list('pk', flat=True)
+        )
+        counters = {
+            field: count_subquery(model) for field, model in COUNTERS.items()
+        }
+        for start in range(0, len(recipes_id), BATCH_SIZE):
+            Recipe.objects.filter(
+                pk__in=recipes_id[start:start + BATCH_SIZE]
+            ).update(**counters)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Reconcile completed: {len(recipes_id)} recipes fixed'
+            )
+        )
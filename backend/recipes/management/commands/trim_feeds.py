@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db.models import Count
+
+from recipes.feeds import trim_feed
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрезка лент подписок до FEED_MAX_LENGTH последних записей. '
+        'Обрабатываются только переполненные ленты.'
+    )
+
+    def handle(self, *args, **options):
+        users_id = list(
+            FeedEntry.objects.order_by()
+            .values('user_id')
+            .annotate(entries=Count('pk'))
+            .filter(entries__gt=settings.FEED_MAX_LENGTH)
+            .values_list('user_id', flat=True)
+        )
+        deleted = sum(trim_feed(user_id) for user_id in users_id)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Trim completed: {deleted} entries deleted')
+        )
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_cart_ingredients(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartIngredient = apps.get_model(
+        'recipes', 'ShoppingCartIngredient'
+    )
+    amounts = (
+        RecipeIngredient.objects.filter(recipe__shopping__isnull=False)
+        .values('recipe__shopping__user_id', 'ingredient_id')
+        .annotate(total_amount=models.Sum('amount'))
+        .order_by()
+    )
+    ShoppingCartIngredient.objects.bulk_create(
+        ShoppingCartIngredient(
+            user_id=row['recipe__shopping__user_id'],
+            ingredient_id=row['ingredient_id'],
+            amount=row['total_amount'],
+        )
+        for row in amounts.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField()),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_ingredients', to='recipes.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_ingredients', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'ингредиент в корзине',
+                'verbose_name_plural': 'ингредиенты в корзине',
+                'ordering': ('user',),
+                'default_related_name': 'shopping_ingredients',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_ingredient'),
+        ),
+        migrations.RunPython(
+            fill_shopping_cart_ingredients, migrations.RunPython.noop
+        ),
+    ]
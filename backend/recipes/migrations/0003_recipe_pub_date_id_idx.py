@@ -0,0 +1,21 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'default_related_name': 'recipes', 'ordering': ('-pub_date', '-id'), 'verbose_name': 'рецепт', 'verbose_name_plural': 'рецепты'},
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'),
+        ),
+    ]
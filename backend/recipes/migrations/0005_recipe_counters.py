@@ -0,0 +1,55 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:14
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model):
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(recipe=models.OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(count=models.Count('pk'))
+            .values('count'),
+            output_field=models.PositiveIntegerField(),
+        ),
+        0,
+    )
+
+
+def fill_recipe_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteList = apps.get_model('recipes', 'FavoriteList')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    Recipe.objects.update(
+        favorites_count=count_subquery(FavoriteList),
+        in_carts_count=count_subquery(ShoppingList),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(
+            fill_recipe_counters, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+SEARCH_SQL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(text, '')), 'B')"
+    ") STORED",
+    'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+    'USING gin (search_vector)',
+    'CREATE INDEX recipe_name_trgm_idx ON recipes_recipe '
+    'USING gin (name gin_trgm_ops)',
+)
+REVERSE_SQL = (
+    'DROP INDEX IF EXISTS recipe_name_trgm_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+
+def run_on_postgres(*statements):
+    """
+    Поисковый столбец и индексы есть только на PostgreSQL, на других базах
+    поиск работает через индекс в памяти процесса.
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgres(*SEARCH_SQL), run_on_postgres(*REVERSE_SQL)
+        ),
+    ]
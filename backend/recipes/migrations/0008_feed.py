@@ -0,0 +1,51 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0007_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'запись ленты',
+                'verbose_name_plural': 'записи ленты',
+                'ordering': ('user', '-recipe'),
+                'default_related_name': 'feed_entries',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_feeds',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('in_feeds', False)), fields=['author', '-pub_date'], name='recipe_feed_pull_idx'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_entry'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.18 on 2026-10-18 04:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_recipes', to='recipes.recipe')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='recipes.recipe')),
+            ],
+            options={
+                'verbose_name': 'похожий рецепт',
+                'verbose_name_plural': 'похожие рецепты',
+                'ordering': ('recipe', '-score'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'similar'), name='unique_similar_recipe'),
+        ),
+    ]
@@ -56,6 +56,7 @@ class Recipe(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=150)
     image = models.ImageField(upload_to='recipes/images/', max_length=300)
+    image_variants = models.JSONField(default=dict, editable=False)
     text = models.TextField()
     ingredients = models.ManyToManyField(
         Ingredient, through='RecipeIngredient'
@@ -69,12 +70,30 @@ class Recipe(models.Model):
         )
     )
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(default=0, editable=False)
+    in_feeds = models.BooleanField(default=False, editable=False)
 
     class Meta:
         default_related_name = 'recipes'
         verbose_name = 'рецепт'
         verbose_name_plural = 'рецепты'
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_feed_pull_idx',
+                condition=models.Q(in_feeds=False),
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -151,3 +170,74 @@ class FavoriteList(models.Model):
 
     def __str__(self):
         return f'{self.user} -> {self.recipe}'
+
+
+class ShoppingCartIngredient(models.Model):
+    """Модель суммарного количества ингредиента в корзине пользователя"""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()
+
+    class Meta:
+        default_related_name = 'shopping_ingredients'
+        verbose_name = 'ингредиент в корзине'
+        verbose_name_plural = 'ингредиенты в корзине'
+        ordering = ('user',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_ingredient',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} -> {self.ingredient}: {self.amount}'
+
+
+class FeedEntry(models.Model):
+    """Модель записи ленты подписок пользователя"""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+
+    class Meta:
+        default_related_name = 'feed_entries'
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        ordering = ('user', '-recipe')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} -> {self.recipe}'
+
+
+class SimilarRecipe(models.Model):
+    """Модель похожего рецепта, рассчитанного заранее"""
+
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='similar_recipes'
+    )
+    similar = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='similar_to'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        verbose_name = 'похожий рецепт'
+        verbose_name_plural = 'похожие рецепты'
+        ordering = ('recipe', '-score')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} -> {self.similar}: {self.score:.3f}'
@@ -0,0 +1,138 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+
+class TokenCache:
+    """
+    Ограниченный по размеру LRU-кэш токен -> (пользователь, токен)
+    с временем жизни записей. Кэш свой у каждого процесса, поэтому каждая
+    запись хранит версию токена из общего кэша Django и действительна,
+    только пока версия не изменилась: отзыв токена в любом процессе меняет
+    её для всех.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_version_key(key):
+        return f'token_version:{key}'
+
+    def get_version(self, key):
+        version_key = self._get_version_key(key)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, time.time(), None)
+            version = cache.get(version_key)
+
+        return version
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+        if (
+            item is None
+            or item[0] < time.monotonic()
+            or item[1] != self.get_version(key)
+        ):
+            with self._lock:
+                self._items.pop(key, None)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+            self.hits += 1
+        return item[2]
+
+    def set(self, key, value, version):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, version, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def revoke(self, keys):
+        """Отзываем токены во всех процессах."""
+        cache.set_many(
+            {self._get_version_key(key): time.time() for key in keys}, None
+        )
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._items),
+        }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который берёт пользователя из token_cache и
+    обращается к базе только при промахе.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            # Версию читаем до базы: отзыв после чтения её изменит.
+            version = token_cache.get_version(key)
+            cached = super().authenticate_credentials(key)
+            token_cache.set(key, cached, version)
+
+        user, token = cached
+        return copy.copy(user), token
+
+
+# Выход, смена пароля и деактивация пользователя проходят через удаление
+# токена или сохранение пользователя, в том числе из админки. Версию
+# меняем после коммита, чтобы процесс, прочитавший токен до коммита, не
+# сохранил его с новой версией.
+def schedule_revoke(keys):
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: token_cache.revoke(keys))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(instance, **kwargs):
+    schedule_revoke((instance.key,))
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_user_tokens(instance, created, **kwargs):
+    if not created:
+        schedule_revoke(
+            Token.objects.filter(user_id=instance.pk).values_list(
+                'key', flat=True
+            )
+        )
@@ -9,3 +9,8 @@ class PasswordFailedException(APIException):
 
 class SubscribeException(APIException):
     status_code = status.HTTP_400_BAD_REQUEST
+
+
+class RecipesLimitException(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'recipes_limit должен быть неотрицательным целым числом.'
@@ -1,4 +1,37 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+COUNT_CACHE_THRESHOLD = 1000
+COUNT_CACHE_TIMEOUT = 60
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Пагинатор, кэширующий COUNT(*) для больших выборок. Небольшие выборки
+    считаются точно, для больших число объектов может отставать на время
+    жизни кэша.
+    """
+
+    @cached_property
+    def count(self):
+        try:
+            query = str(self.object_list.query).encode()
+        except EmptyResultSet:
+            return 0
+
+        key = f'paginator_count:{hashlib.md5(query).hexdigest()}'
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            if count >= COUNT_CACHE_THRESHOLD:
+                cache.set(key, count, COUNT_CACHE_TIMEOUT)
+
+        return count
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -6,3 +39,33 @@ class CustomPageNumberPagination(PageNumberPagination):
 
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class RecipePageNumberPagination(CustomPageNumberPagination):
+    """
+    Постраничный пагинатор рецептов. По умолчанию общее число рецептов
+    считается точно, с ?count=approximate — берётся из кэша.
+    """
+
+    count_query_param = 'count'
+    approximate_count = 'approximate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            request.query_params.get(self.count_query_param)
+            == self.approximate_count
+        ):
+            self.django_paginator_class = CachedCountPaginator
+
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Пагинатор рецептов по курсору (pub_date, id): стоимость любой страницы
+    одинакова и не требует COUNT(*).
+    """
+
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-pub_date', '-id')
@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
+from recipes.images import get_thumbnail_urls
 from recipes.models import Recipe
 from .utils import get_limit_recipes, is_subscribed, recipes_count
 
@@ -38,6 +39,9 @@ class UserSerializer(serializers.ModelSerializer):
         if not request:
             return False
 
+        if hasattr(obj, IS_SUBSCRIBED_KEY):
+            return getattr(obj, IS_SUBSCRIBED_KEY)
+
         return is_subscribed(request.user, obj.id)
 
 
@@ -79,6 +83,7 @@ class ShortRecipesSerializer(serializers.ModelSerializer):
     """
 
     image = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -86,6 +91,7 @@ class ShortRecipesSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time',
         )
 
@@ -94,6 +100,9 @@ class ShortRecipesSerializer(serializers.ModelSerializer):
         photo_url = obj.image.url
         return request.build_absolute_uri(photo_url)
 
+    def get_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, self.context.get('request'))
+
 
 class MySubscriptionsSerializer(UserSerializer):
     """Сериалайзер для просмотра собственных подписок пользователя."""
@@ -115,10 +124,17 @@ class MySubscriptionsSerializer(UserSerializer):
         )
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+
         return recipes_count(obj)
 
     def get_recipes(self, obj):
-        qs = get_limit_recipes(self, obj)
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            qs = recipes_by_author[obj.id]
+        else:
+            qs = get_limit_recipes(self, obj)
 
         return ShortRecipesSerializer(
             qs, many=True, context={"request": self.context.get('request')}
@@ -0,0 +1,131 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from users.authentication import token_cache
+from recipes.models import Recipe
+from users.models import Follow, User
+
+
+class TokenCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user',
+            email='user@example.com',
+            first_name='user',
+            last_name='user',
+            password='password-12345',
+        )
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    def assertRevokedEverywhere(self, revoke):
+        """
+        Проверяем, что токен отклоняется и процессом, в котором отозван,
+        и другими процессами, у которых запись осталась в локальном кэше.
+        """
+        self.assertEqual(self.get_me().status_code, 200)
+        other_process_items = dict(token_cache._items)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke()
+
+        self.assertEqual(self.get_me().status_code, 401)
+        token_cache._items.update(other_process_items)
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_hits_and_misses(self):
+        stats = token_cache.stats()
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.get_me().status_code, 200)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_me().status_code, 200)
+
+        self.assertEqual(token_cache.misses - stats['misses'], 1)
+        self.assertEqual(token_cache.hits - stats['hits'], 1)
+
+    def test_rejected_after_logout(self):
+        self.assertRevokedEverywhere(
+            lambda: self.client.post('/api/auth/token/logout/')
+        )
+
+    def test_rejected_after_password_change(self):
+        def change_password():
+            response = self.client.post(
+                '/api/users/set_password/',
+                {
+                    'current_password': 'password-12345',
+                    'new_password': 'password-67890',
+                },
+            )
+            self.assertEqual(response.status_code, 204)
+
+        self.assertRevokedEverywhere(change_password)
+
+    def test_rejected_after_deactivation(self):
+        def deactivate():
+            self.user.is_active = False
+            self.user.save()
+
+        self.assertRevokedEverywhere(deactivate)
+
+
+class SubscriptionsTest(TestCase):
+    @classmethod
+    def create_user(cls, username):
+        return User.objects.create_user(
+            username=username,
+            email=f'{username}@example.com',
+            first_name=username,
+            last_name=username,
+            password='password-12345',
+        )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('user')
+        for i in range(10):
+            author = cls.create_user(f'author{i}')
+            Follow.objects.create(user=cls.user, author=author)
+            for j in range(3):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'рецепт {i}-{j}',
+                    text='описание',
+                    image='recipes/images/test.jpg',
+                    cooking_time=10,
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_subscriptions(self, **params):
+        return self.client.get('/api/users/subscriptions/', params)
+
+    def test_query_count_does_not_depend_on_authors(self):
+        for limit in (1, 10):
+            with self.subTest(limit=limit), self.assertNumQueries(3):
+                response = self.get_subscriptions(limit=limit, recipes_limit=2)
+            self.assertEqual(len(response.data['results']), limit)
+            for author in response.data['results']:
+                self.assertEqual(len(author['recipes']), 2)
+                self.assertEqual(author['recipes_count'], 3)
+
+    def test_invalid_recipes_limit(self):
+        for value in ('x', '-1', '1.5'):
+            with self.subTest(value=value):
+                response = self.get_subscriptions(recipes_limit=value)
+                self.assertEqual(response.status_code, 400)
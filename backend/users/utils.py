@@ -1,4 +1,34 @@
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
 from recipes.models import Recipe
+from .exceptions import RecipesLimitException
+
+
+def insert_ignore(model, **values):
+    """
+    Добавляем строку одним INSERT ... ON CONFLICT DO NOTHING.
+    Возвращаем True, если строка вставлена, и False, если она уже была.
+    """
+    ops = connection.ops
+    fields = [model._meta.get_field(name) for name in values]
+    params = [
+        field.get_db_prep_save(value, connection)
+        for field, value in zip(fields, values.values())
+    ]
+    sql = '{} {} ({}) VALUES ({}) {}'.format(
+        ops.insert_statement(ignore_conflicts=True),
+        ops.quote_name(model._meta.db_table),
+        ', '.join(ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+        ops.ignore_conflicts_suffix_sql(ignore_conflicts=True),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
 
 
 def is_subscribed(user, author_id):
@@ -23,8 +53,55 @@ def get_limit_recipes(serializer_instance, user):
     if not request:
         return user.recipes.all()
 
-    limit = request.query_params.get('recipes_limit')
-    if limit:
-        return user.recipes.all()[: int(limit)]
+    limit = get_recipes_limit(request)
+    if limit is not None:
+        return user.recipes.all()[:limit]
 
     return user.recipes.all()
+
+
+def get_recipes_limit(request):
+    """Получаем recipes_limit из параметров запроса или None."""
+    limit = request.query_params.get('recipes_limit')
+    if not limit:
+        return None
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise RecipesLimitException
+
+    if limit < 0:
+        raise RecipesLimitException
+
+    return limit
+
+
+def get_limit_recipes_by_author(authors_id, limit=None):
+    """
+    Получаем рецепты сразу всех авторов одним запросом. При переданном
+    лимите для каждого автора оставляем не более limit последних рецептов.
+    """
+    recipes = Recipe.objects.filter(author_id__in=authors_id).only(
+        'id', 'name', 'image', 'image_variants', 'cooking_time', 'author'
+    )
+    if limit is not None:
+        recipes = recipes.annotate(
+            recipe_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=F('pub_date').desc(),
+            )
+        )
+        sql, params = recipes.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) AS limit_recipes '
+            'WHERE recipe_number <= %s ORDER BY recipe_number',
+            (*params, limit),
+        )
+
+    recipes_by_author = defaultdict(list)
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+
+    return recipes_by_author
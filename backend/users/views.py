@@ -1,4 +1,6 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BooleanField, Count, Value
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.authtoken.models import Token
@@ -7,12 +9,17 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from recipes.feeds import add_author_to_feed, remove_author_from_feed
 from . import serializers
 from .exceptions import PasswordFailedException, SubscribeException
 from .mixins import ListCreateRetrieveModelMixin
 from .models import Follow
 from .paginations import CustomPageNumberPagination
-from .utils import is_subscribed
+from .utils import (
+    get_limit_recipes_by_author,
+    get_recipes_limit,
+    insert_ignore,
+)
 
 User = get_user_model()
 
@@ -41,11 +48,14 @@ class UserViewSet(ListCreateRetrieveModelMixin):
         if request.user == author:
             raise SubscribeException('Подписка на самого себя запрещена.')
 
-        if is_subscribed(request.user, author.id):
-            raise SubscribeException('Подписка уже оформлена.')
+        with transaction.atomic():
+            if not insert_ignore(
+                Follow, user=request.user.id, author=author.id
+            ):
+                raise SubscribeException('Подписка уже оформлена.')
+
+            add_author_to_feed(request.user.id, author.id)
 
-        follow = Follow.objects.create(user=request.user, author=author)
-        follow.save()
         serializer = serializers.MySubscriptionsSerializer(
             author, context={'request': request}
         )
@@ -53,14 +63,16 @@ class UserViewSet(ListCreateRetrieveModelMixin):
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, pk):
-        author = get_object_or_404(User, id=pk)
-
-        if not is_subscribed(request.user, pk):
-            raise SubscribeException(f'Подписка на {author} не оформлена.')
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                user=request.user, author_id=pk
+            ).delete()
+            if deleted:
+                remove_author_from_feed(request.user.id, pk)
+                return Response(status=status.HTTP_204_NO_CONTENT)
 
-        follow = get_object_or_404(Follow, user=request.user, author=author)
-        follow.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        author = get_object_or_404(User, id=pk)
+        raise SubscribeException(f'Подписка на {author} не оформлена.')
 
     @action(
         methods=['get'],
@@ -68,25 +80,32 @@ class UserViewSet(ListCreateRetrieveModelMixin):
         permission_classes=[IsAuthenticated],
     )
     def subscriptions(self, request):
-        user = get_object_or_404(User, id=self.request.user.id)
-        followings_id = user.follower.values_list('author_id', flat=True)
-        followings = User.objects.filter(id__in=followings_id)
+        limit = get_recipes_limit(request)
+        followings = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id')
 
         page = self.paginate_queryset(followings)
-        if page is not None:
-            serializer = serializers.MySubscriptionsSerializer(
-                page, many=True, context={'request': request}
-            )
-            return self.get_paginated_response(serializer.data)
+        authors = page if page is not None else list(followings)
 
-        serializer = serializers.MySubscriptionsSerializer(
-            followings, many=True, context={'request': request}
+        recipes_by_author = get_limit_recipes_by_author(
+            [author.id for author in authors], limit
         )
-        return Response(
-            serializer.data,
-            status=status.HTTP_200_OK,
-            context={'request': request},
+        serializer = serializers.MySubscriptionsSerializer(
+            authors,
+            many=True,
+            context={
+                'request': request,
+                'recipes_by_author': recipes_by_author,
+            },
         )
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(
         methods=['get'],
@@ -140,6 +159,8 @@ class SetPasswordView(APIView):
         ):
             user.set_password(serializer.validated_data.get('new_password'))
             user.save()
+            # После смены пароля прежний токен не должен действовать.
+            Token.objects.filter(user=user).delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         raise PasswordFailedException